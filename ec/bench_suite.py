@@ -0,0 +1,129 @@
+"""
+Throughput benchmark suite for the tuned bitmatrix kernel
+
+The hot-cache numbers of get_best_benchmark time the same buffers over and
+over. The suite also measures
+  - cold: every call encodes the next of a ring of stripes larger than the
+    last level cache, so data comes from memory as in production;
+  - stream: stripes of the ring are encoded back to back, one sample per
+    pass over the ring;
+and reports per-sample percentiles and 95% confidence intervals as records
+for result.json, next to the usual execution_time(s) / bandwidth(MB/s).
+"""
+
+import math
+import time
+import numpy as np
+import tvm
+from bitmatrix_autoschedule import get_cached_func
+from common import aligned_empty, as_tvm_array, get_llc_size, pin_threads
+from common import np_expand_bitmatrix, np_fill_bitmatrix, load_bitmatrix
+
+MODES = ('warm', 'cold', 'stream')
+PERCENTILES = (5, 50, 95, 99)
+
+
+def summarize(ex_time, nbytes):
+    """
+    Statistics of per-sample execution times (s) of kernels touching
+    nbytes of data each
+    """
+    ex_time = np.asarray(ex_time)
+    bandwidth = nbytes / (1024**2) / ex_time
+    n = len(bandwidth)
+    # normal approximation, the suite takes enough samples for it
+    half = 1.96 * np.std(bandwidth, ddof=1) / math.sqrt(n) if n > 1 else 0.0
+    stats = {
+        'samples': n,
+        'execution_time(s)': float(np.mean(ex_time)),
+        'bandwidth(MB/s)': float(np.mean(bandwidth)),
+        'std': float(np.std(bandwidth)),
+        'ci95(MB/s)': [float(np.mean(bandwidth) - half), float(np.mean(bandwidth) + half)],
+    }
+    for q in PERCENTILES:
+        stats['p' + str(q) + '(MB/s)'] = float(np.percentile(bandwidth, q))
+    return stats
+
+
+def benchmark_suite(argv):
+    """
+    Run the suite modes in argv['modes'] on the tuned schedule in
+    argv['log_file']; returns one record per mode
+    """
+    if argv.get('cpus'):
+        pin_threads(argv['cpus'])
+    func = get_cached_func(argv)
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
+    M = ecParity * ecW
+    K = ecData * ecW
+    samples = argv.get('samples', 1000)
+
+    if argv.get('input_bitmatrix'):
+        a_np = np_fill_bitmatrix(load_bitmatrix(argv['input_bitmatrix']), dtype)
+    else:
+        a_np = np_expand_bitmatrix(np.random.randint(
+            np.iinfo(np.uint8).max,
+            size=(M, ecData)).astype(np.uint8), dtype)
+
+    # enough stripes to flush the last level cache twice per pass
+    stripe_bytes = (K + M) * N * np.dtype(dtype).itemsize
+    num_stripes = max(2, math.ceil(2 * argv.get('llc_size', get_llc_size()) / stripe_bytes))
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(a_np, device=dev)
+    ring = []
+    for _ in range(num_stripes):
+        b_np = aligned_empty((K, N), dtype)
+        b_np[...] = np.random.randint(np.iinfo(dtype).max, size=(K, N), dtype=dtype)
+        out_np = aligned_empty((M, N), dtype)
+        ring.append((as_tvm_array(b_np, dev), as_tvm_array(out_np, dev)))
+    nbytes = K * N * np.dtype(dtype).itemsize
+
+    results = []
+    for mode in argv.get('modes', MODES):
+        if mode == 'warm':
+            b_tvm, out_tvm = ring[0]
+            func(a_tvm, b_tvm, out_tvm)
+            evaluator = func.time_evaluator(
+                func.entry_name, dev, number=1, repeat=samples)
+            ex_time = evaluator(a_tvm, b_tvm, out_tvm).results
+            stats = summarize(ex_time, nbytes)
+        elif mode == 'cold':
+            ex_time = []
+            for i in range(samples + num_stripes):
+                b_tvm, out_tvm = ring[i % num_stripes]
+                tic = time.perf_counter()
+                func(a_tvm, b_tvm, out_tvm)
+                if i >= num_stripes:
+                    ex_time.append(time.perf_counter() - tic)
+            stats = summarize(ex_time, nbytes)
+        elif mode == 'stream':
+            passes = max(10, samples // num_stripes)
+            ex_time = []
+            for i in range(passes + 1):
+                tic = time.perf_counter()
+                for b_tvm, out_tvm in ring:
+                    func(a_tvm, b_tvm, out_tvm)
+                if i:
+                    ex_time.append(time.perf_counter() - tic)
+            stats = summarize(ex_time, nbytes * num_stripes)
+        else:
+            raise ValueError("Invalid benchmark mode: " + mode)
+
+        results.append(dict({
+            'ecParity': ecParity,
+            'N': argv['N'],
+            'ecData': ecData,
+            'ecW': ecW,
+            'dtype': dtype,
+            'log_file': argv['log_file'],
+            'tune_num_trials_total': argv.get('tune_num_trials_total'),
+            'mode': mode,
+            'stripes': 1 if mode == 'warm' else num_stripes,
+            'cpus': list(argv['cpus']) if argv.get('cpus') else None,
+        }, **stats))
+    return results
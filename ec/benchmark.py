@@ -1,12 +1,26 @@
 from bitmatrix_autoschedule import benchmark as b_benchmark
 from bitmatrix_autoschedule import benchmark_decode as b_benchmark_decode
+from bitmatrix_autoschedule import benchmark_batch as b_benchmark_batch
+from bitmatrix_autoschedule import benchmark_checksum as c_benchmark
+from bitmatrix_autoschedule import benchmark_packed as p_benchmark
+from bitmatrix_autoschedule import benchmark_delta as u_benchmark
 from bitmatrix_autoschedule import get_best_benchmark as b_best_benchmark
+from bitmatrix_autoschedule import get_best_benchmark_zero_copy as b_best_benchmark_zero_copy
+from bitmatrix_autoschedule import get_search_task
+from warm_start import neighbor_logs
+from bench_suite import benchmark_suite, MODES
+from gf_autoschedule import benchmark_gf as t_benchmark
+from gf_autoschedule import get_best_gf_benchmark as t_best_benchmark
+from gf_autoschedule import get_gf_search_task
 from gemm_autoschedule import benchmark as g_benchmark
 from gemm_autoschedule import get_best_benchmark as g_best_benchmark
+from collections import Counter
 from copy import deepcopy
+from tvm import auto_scheduler
 import json
 import argparse
 import gc
+import os
 
 
 def add_common_args(parser):
@@ -16,6 +30,10 @@ def add_common_args(parser):
     parser.add_argument('-ecParity', type=int, default=4)
     parser.add_argument('-ecData', type=int, default=8)
     parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8',
+                        help='Word type the bitmatrix kernel processes packets in: uint8, uint32 or uint64')
+    parser.add_argument('-batch', type=int, default=1,
+                        help='Number of stripes encoded per kernel call, tunes the batched workload if > 1')
     parser.add_argument('--read_log_file', default=None,
                         help='Run the benchmark with tuned schedule in log file')
     parser.add_argument('--log_dir', default='log/default/',
@@ -28,12 +46,107 @@ def add_common_args(parser):
     parser.add_argument("--config_file", default=None,
                         help='The configuration file (JSON) to run the experiment. \
                         should consists of a list of benchmark configs')
+    parser.add_argument('--tune_serially', action='store_true',
+                        help='Tune the configs of --config_file one after another instead of jointly')
+    parser.add_argument('--warm_start', type=int, default=0,
+                        help='Seed tuning with the best records of this many neighboring geometries in log_dir')
     parser.add_argument("--computation", default='b',
-                        help='Specify the computation type: "b" for bitmatrix, "g" for gemm')
+                        help='Specify the computation type: "b" for bitmatrix, "c" for bitmatrix with checksums, "p" for bit-packed bitmatrix, "u" for the parity update of one rewritten fragment, "t" for GF(2^8) nibble table lookups, "g" for gemm')
+    parser.add_argument('--checksum_width', type=int, default=64,
+                        help='Number of XOR-fold lanes per packet checksum for computation "c"')
     parser.add_argument('--export', '-e', default=None, type=str)
     parser.add_argument('--decode', '-d', action='store_true')
+    parser.add_argument('--erasures', type=int, default=None,
+                        help='With --decode, tune the kernel recovering this many data fragments instead of all of them')
     parser.add_argument('--verbose', '-v', type=int, default=1)
     parser.add_argument('--input_bitmatrix', default=None, type=str)
+    parser.add_argument('--zero_copy', action='store_true',
+                        help='Compare copying and zero-copy host buffers with the tuned schedule')
+    parser.add_argument('--suite', action='store_true',
+                        help='Run the warm / cold / streaming throughput suite on the tuned schedule')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES,
+                        help='Modes of the benchmark suite')
+    parser.add_argument('--samples', type=int, default=1000,
+                        help='Number of timed kernel calls per suite mode')
+    parser.add_argument('--cpus', nargs='+', type=int, default=None,
+                        help='Pin the process and one TVM thread to each of these cpus')
+
+
+def log_prefix(computation, batch, dtype='uint8', erasures=None):
+    prefix = {'c': 'C_', 'p': 'packed_', 'u': 'delta_', 't': 'gf_'}.get(computation, '')
+    if computation == 'b' and erasures:
+        prefix += 'E_' + str(erasures) + '_'
+    if computation == 'b' and batch > 1:
+        # the batched workload is uint8 only
+        prefix += 'B_' + str(batch) + '_'
+    elif computation == 'b' and dtype != 'uint8':
+        prefix += dtype + '_'
+    return prefix
+
+
+def tune_jointly(argv, configs):
+    """
+    Tune the EC configs with one TaskScheduler, so tuning time goes to the
+    tasks whose latency improves the most and all tasks share one cost model.
+
+    Measurements go to a joint log in log_dir (seeded from the per-config
+    logs on the first run), which the scheduler resumes from. Each config
+    asks for tune_num_trials_total measurements in total, only the missing
+    ones are run. New records are appended to the per-config logs too.
+    """
+    tasks = {}
+    for a in configs:
+        if argv.computation == 't':
+            task = get_gf_search_task(a)
+        else:
+            task = get_search_task(a, argv.computation, argv.decode)
+        tasks.setdefault(task.workload_key, (task, a))
+
+    os.makedirs(argv.log_dir, exist_ok=True)
+    # encode and decode runs resume from their own joint logs
+    joint_log = argv.log_dir + ('decode_' if argv.decode else '') + \
+        log_prefix(argv.computation, argv.batch, argv.dtype, argv.erasures if argv.decode else None) + 'tasks.json'
+    if not os.path.exists(joint_log):
+        with open(joint_log, 'w') as out:
+            for _, a in tasks.values():
+                if os.path.exists(a['log_file']):
+                    with open(a['log_file']) as f:
+                        out.write(f.read())
+
+    measured = Counter(inp.task.workload_key for inp, _ in auto_scheduler.load_records(joint_log))
+    num_records = sum(measured.values())
+    remaining = sum(max(a['tune_num_trials_total'] - measured[key], 0)
+                    for key, (_, a) in tasks.items())
+    if remaining == 0:
+        return
+    if remaining < len(tasks):
+        # the scheduler tunes every task at least once
+        print("tune_jointly: %d trials left for %d tasks, running %d so each task gets a round"
+              % (remaining, len(tasks), len(tasks)))
+        remaining = len(tasks)
+
+    # weight latencies by the bytes encoded, so every config counts per byte
+    size = {key: a['ecData'] * a['ecW'] * a['N'] * a.get('batch', 1) for key, (_, a) in tasks.items()}
+    tuner = auto_scheduler.TaskScheduler(
+        [task for task, _ in tasks.values()],
+        task_weights=[max(size.values()) / size[key] for key in tasks],
+        load_log_file=joint_log if num_records else None)
+    tune_option = auto_scheduler.TuningOptions(
+        num_measure_trials=remaining,
+        measure_callbacks=[auto_scheduler.RecordToFile(joint_log)],
+        verbose=0,
+    )
+    tuner.tune(tune_option, search_policy='sketch.xgb')
+
+    new_records = {}
+    for i, (inp, res) in enumerate(auto_scheduler.load_records(joint_log)):
+        if i >= num_records:
+            new_records.setdefault(inp.task.workload_key, []).append((inp, res))
+    for key, records in new_records.items():
+        if key in tasks:
+            inputs = [inp for inp, _ in records]
+            results = [res for _, res in records]
+            auto_scheduler.save_records(tasks[key][1]['log_file'], inputs, results)
 
 
 def run_benchmark(argv):
@@ -43,6 +156,14 @@ def run_benchmark(argv):
             benchmark = b_benchmark_decode
         else:
             benchmark = b_benchmark
+    elif argv.computation == 'c':
+        benchmark = c_benchmark
+    elif argv.computation == 'p':
+        benchmark = p_benchmark
+    elif argv.computation == 'u':
+        benchmark = u_benchmark
+    elif argv.computation == 't':
+        benchmark = t_benchmark
     else:
         benchmark = g_benchmark
     a = {}
@@ -50,16 +171,22 @@ def run_benchmark(argv):
         with open(argv.config_file) as f:
             experiments = json.load(f)
 
+        configs = []
         for exp in experiments:
-            if argv.computation == 'b':
+            if argv.computation in ('b', 'c', 'p', 'u', 't'):
                 a = {
                     'ecParity': exp.get('ecParity', None),
                     'N': exp['N'],
                     'ecData': exp['ecData'],
                     'ecW': exp['ecW'],
-                    'log_file': argv.log_dir + 'P_' + str(exp.get('ecParity', 'X')) + '_n_' + str(exp['N']) + '_D_' + str(exp['ecData']) + '.json',
+                    'batch': exp.get('batch', argv.batch),
+                    'dtype': exp.get('dtype', argv.dtype),
+                    'erasures': exp.get('erasures', argv.erasures) if argv.decode else None,
+                    'log_file': argv.log_dir + log_prefix(argv.computation, exp.get('batch', argv.batch), exp.get('dtype', argv.dtype), exp.get('erasures', argv.erasures) if argv.decode else None) + 'P_' + str(exp.get('ecParity', 'X')) + '_n_' + str(exp['N']) + '_D_' + str(exp['ecData']) + '.json',
                     'tune_num_trials_total': exp['tune_num_trials_total'],
                     'bandwidth_size': 'h',
+                    'checksum_width': argv.checksum_width,
+                    'warm_start_logs': neighbor_logs(argv.log_dir, exp.get('ecParity', None), exp['ecData'], exp['N'], log_prefix(argv.computation, exp.get('batch', argv.batch), exp.get('dtype', argv.dtype)), argv.warm_start),
                     'export': argv.export
                 }
             else:
@@ -71,8 +198,18 @@ def run_benchmark(argv):
                     'tune_num_trials_total': exp['tune_num_trials_total'],
                     'export': argv.export
                 }
+            configs.append(a)
 
-            out = benchmark(a)
+        if argv.computation in ('b', 'c', 'p', 'u', 't') and not argv.tune_serially:
+            tune_jointly(argv, configs)
+            for a in configs:
+                a['tune'] = False
+
+        for a in configs:
+            if a.get('batch', 1) > 1 and argv.computation == 'b' and not argv.decode:
+                out = b_benchmark_batch(a)
+            else:
+                out = benchmark(a)
             a['execution_time(s)'] = out[0]
             a['bandwidth(MB/s)'] = out[1]
             
@@ -88,18 +225,26 @@ def run_benchmark(argv):
             gc.collect()
 
     else:
-        if argv.computation == 'b':
+        if argv.computation in ('b', 'c', 'p', 'u', 't'):
             a = {
                 'ecParity': argv.ecParity,
                 'N': argv.N,
                 'ecData': argv.ecData,
                 'ecW': argv.ecW,
-                'log_file': argv.log_dir + 'P_' + str(argv.ecParity) + '_n_' + str(argv.N) + '_D_' + str(argv.ecData) + '.json',
+                'batch': argv.batch,
+                'dtype': argv.dtype,
+                'erasures': argv.erasures if argv.decode else None,
+                'log_file': argv.log_dir + log_prefix(argv.computation, argv.batch, argv.dtype, argv.erasures if argv.decode else None) + 'P_' + str(argv.ecParity) + '_n_' + str(argv.N) + '_D_' + str(argv.ecData) + '.json',
                 'tune_num_trials_total': argv.tune_num_trials_total,
                 'bandwidth_size': 'h',
+                'checksum_width': argv.checksum_width,
+                'warm_start_logs': neighbor_logs(argv.log_dir, argv.ecParity, argv.ecData, argv.N, log_prefix(argv.computation, argv.batch, argv.dtype), argv.warm_start),
                 'export': argv.export,
             }
-            out = benchmark(a)
+            if argv.batch > 1 and argv.computation == 'b' and not argv.decode:
+                out = b_benchmark_batch(a)
+            else:
+                out = benchmark(a)
             a['execution_time(s)'] = out[0]
             a['bandwidth(MB/s)'] = out[1]
             a['std'] = out[2]
@@ -131,6 +276,8 @@ def best_benchmark(argv):
     if argv.computation == 'b':
         if argv.decode:
             get_best_benchmark = b_best_benchmark_decode
+        elif argv.zero_copy:
+            get_best_benchmark = b_best_benchmark_zero_copy
         else:
             get_best_benchmark = b_best_benchmark
         a = {
@@ -138,12 +285,39 @@ def best_benchmark(argv):
             'N': argv.N,
             'ecData': argv.ecData,
             'ecW': argv.ecW,
+            'dtype': argv.dtype,
             'log_file': argv.read_log_file,
             'bandwidth_size': 'h',
             'export': argv.export,
             'verbose': argv.verbose,
             'input_bitmatrix': argv.input_bitmatrix
         }
+    elif argv.computation in ('c', 'p', 'u'):
+        # the tuning benchmarks check and time the best record without tuning
+        get_best_benchmark = {'c': c_benchmark, 'p': p_benchmark, 'u': u_benchmark}[argv.computation]
+        a = {
+            'ecParity': argv.ecParity,
+            'N': argv.N,
+            'ecData': argv.ecData,
+            'ecW': argv.ecW,
+            'dtype': argv.dtype,
+            'checksum_width': argv.checksum_width,
+            'log_file': argv.read_log_file,
+            'tune': False,
+            'tune_num_trials_total': 0,
+            'bandwidth_size': 'h',
+            'export': argv.export,
+        }
+    elif argv.computation == 't':
+        get_best_benchmark = t_best_benchmark
+        a = {
+            'ecParity': argv.ecParity,
+            'N': argv.N,
+            'ecData': argv.ecData,
+            'ecW': argv.ecW,
+            'log_file': argv.read_log_file,
+            'verbose': argv.verbose,
+        }
     else:
         get_best_benchmark = g_best_benchmark
         a = {
@@ -153,6 +327,16 @@ def best_benchmark(argv):
             'log_file': argv.read_log_file,
             'export': argv.export
         }
+    if argv.suite and argv.computation == 'b' and not argv.decode:
+        a['modes'] = argv.modes
+        a['samples'] = argv.samples
+        a['cpus'] = argv.cpus
+        result = benchmark_suite(a)
+        for r in result:
+            print(r)
+        with open(argv.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+        return
     print(get_best_benchmark(a))
 
 
@@ -1,10 +1,16 @@
 import argparse
+import os
+import time
 from common import get_tvm_target_string, export_lib
+from common import aligned_empty, as_tvm_array, is_zero_copy
 import numpy as np
 from statistics import mean, pstdev
 import tvm
 from tvm import te, auto_scheduler
-from common import np_bitmatrix, np_expand_bitmatrix
+from common import np_bitmatrix, np_bitmatrix_multiply, np_expand_bitmatrix, np_fill_bitmatrix, load_bitmatrix
+from common import np_xor_fold, as_words, as_mask_words
+from kernel_cache import get_kernel, log_file_stamp
+from warm_start import warm_start_policy
 
 xor = te.comm_reducer(
     lambda x,
@@ -14,32 +20,54 @@ xor = te.comm_reducer(
         dtype=t),
     name="xor")
 
-# def map(idx, ecW, A):
-#     interm = A & (1 << (ecW - idx - 1))
-# return tir.Select(interm > 0, tvm.tir.const(0xff, dtype='uint8'),
-# tvm.tir.const(0, dtype='uint8'))
+@auto_scheduler.register_workload  # Note the auto_scheduler decorator
+def bitmatrix(M, N, K, dtype):
+    A = te.placeholder((M, K), name="A", dtype=dtype)
+    B = te.placeholder((K, N), name="B", dtype=dtype)
 
-# @auto_scheduler.register_workload  # Note the auto_scheduler decorator
-# def bitmatrix(M, N, K, ecW, dtype):
-#     ecData = K//ecW
-#     A = te.placeholder((M, ecData), name="A", dtype=dtype)
-#     B = te.placeholder((K, N), name="B", dtype=dtype)
+    k = te.reduce_axis((0, K), name="k")
+    bitmul = te.compute(
+        (M, N),
+        lambda i, j: xor(A[i, k] & B[k, j], axis=k),
+        name="bitmul",
+        # enable automatic layout transform for tensor B
+        attrs={"layout_free_placeholders": [B]},
+    )
+    # out = te.compute((M, N), lambda i, j: te.popcount(bitmul[i, j])&0b1, name="out")
 
-#     A_expand = te.compute((M, K), lambda i, j: map(j%ecW, ecW, A[i, te.floordiv(j, ecW)]), name="expand")
+    return [A, B, bitmul]
 
-#     k = te.reduce_axis((0, K), name="k")
-#     bitmul = te.compute(
-#         (M, N),
-#         lambda i, j: xor(A_expand[i, k] & B[k, j], axis = k),
-#         name="bitmul",
-#         attrs={"layout_free_placeholders": [B]},  # enable automatic layout transform for tensor B
-#     )
 
-#     return [A, B, bitmul]
+@auto_scheduler.register_workload
+def bitmatrix_batch(batch, M, N, K, dtype):
+    A = te.placeholder((M, K), name="A", dtype=dtype)
+    B = te.placeholder((batch, K, N), name="B", dtype=dtype)
 
+    k = te.reduce_axis((0, K), name="k")
+    bitmul = te.compute(
+        (batch, M, N),
+        lambda b, i, j: xor(A[i, k] & B[b, k, j], axis=k),
+        name="bitmul",
+        # enable automatic layout transform for tensor B
+        attrs={"layout_free_placeholders": [B]},
+    )
 
-@auto_scheduler.register_workload  # Note the auto_scheduler decorator
-def bitmatrix(M, N, K, dtype):
+    return [A, B, bitmul]
+
+
+@auto_scheduler.register_workload
+def bitmatrix_checksum(M, N, K, L, dtype):
+    """
+    Parity plus XOR-fold checksums of every data and parity packet
+
+    The checksum of a row folds it into L lanes. Folding is linear, so the
+    parity checksums are the encoder applied to the data checksums and the
+    parity never has to be read back. data_sum is its own reduction over B:
+    the kernel is a single call, but whether B is read once for both stages
+    is up to the tuned schedule. N must be a multiple of L, so that every
+    byte is folded.
+    """
+    assert N % L == 0, "N (%d) is not a multiple of the checksum width %d" % (N, L)
     A = te.placeholder((M, K), name="A", dtype=dtype)
     B = te.placeholder((K, N), name="B", dtype=dtype)
 
@@ -51,11 +79,96 @@ def bitmatrix(M, N, K, dtype):
         # enable automatic layout transform for tensor B
         attrs={"layout_free_placeholders": [B]},
     )
-    # out = te.compute((M, N), lambda i, j: te.popcount(bitmul[i, j])&0b1, name="out")
+
+    r = te.reduce_axis((0, N // L), name="r")
+    data_sum = te.compute(
+        (K, L),
+        lambda i, l: xor(B[i, r * L + l], axis=r),
+        name="data_sum",
+    )
+
+    kk = te.reduce_axis((0, K), name="kk")
+    parity_sum = te.compute(
+        (M, L),
+        lambda i, l: xor(A[i, kk] & data_sum[kk, l], axis=kk),
+        name="parity_sum",
+    )
+
+    return [A, B, bitmul, data_sum, parity_sum]
+
+
+def expand_bit(idx, ecW, A):
+    interm = A & (1 << (ecW - idx - 1))
+    return tvm.tir.Select(interm > 0, tvm.tir.const(0xff, dtype='uint8'),
+                          tvm.tir.const(0, dtype='uint8'))
+
+
+@auto_scheduler.register_workload
+def bitmatrix_packed(M, N, K, ecW, dtype):
+    """
+    Same as bitmatrix, but A is the (M, K // ecW) bit-packed bitmatrix
+    (most significant bit first, see common.np_pack_bitmatrix), 1/ecW the size
+    of the 0 / ~0 mask matrix
+    """
+    ecData = K // ecW
+    A = te.placeholder((M, ecData), name="A", dtype=dtype)
+    B = te.placeholder((K, N), name="B", dtype=dtype)
+
+    A_expand = te.compute(
+        (M, K),
+        lambda i, j: expand_bit(j % ecW, ecW, A[i, te.floordiv(j, ecW)]),
+        name="expand")
+
+    k = te.reduce_axis((0, K), name="k")
+    bitmul = te.compute(
+        (M, N),
+        lambda i, j: xor(A_expand[i, k] & B[k, j], axis=k),
+        name="bitmul",
+        # enable automatic layout transform for tensor B
+        attrs={"layout_free_placeholders": [B]},
+    )
 
     return [A, B, bitmul]
 
 
+@auto_scheduler.register_workload
+def bitmatrix_delta(M, N, W, dtype):
+    """
+    Parity update for one rewritten data fragment: A holds the W = ecW
+    bitmatrix columns of that fragment, parity = P ^ A * (Old ^ New).
+    Every element of P is only read for the same element of parity, so the
+    kernel may run with parity aliasing P.
+    """
+    A = te.placeholder((M, W), name="A", dtype=dtype)
+    Old = te.placeholder((W, N), name="Old", dtype=dtype)
+    New = te.placeholder((W, N), name="New", dtype=dtype)
+    P = te.placeholder((M, N), name="P", dtype=dtype)
+
+    k = te.reduce_axis((0, W), name="k")
+    delta = te.compute(
+        (M, N),
+        lambda i, j: xor(A[i, k] & (Old[k, j] ^ New[k, j]), axis=k),
+        name="delta",
+    )
+    parity = te.compute(
+        (M, N),
+        lambda i, j: P[i, j] ^ delta[i, j],
+        name="parity",
+    )
+
+    return [A, Old, New, P, parity]
+
+
+def build_in_place(sch, args, target):
+    """
+    tvm.build without the default tir.noalias, which marks every buffer
+    argument noalias in LLVM: needed for kernels called with the output
+    aliasing an input, such as bitmatrix_delta
+    """
+    with tvm.transform.PassContext(config={"tir.noalias": False}):
+        return tvm.build(sch, args, target)
+
+
 def print_basic_schedule(M, N, K, dtype):
     # declare a matrix element-wise multiply
     A = te.placeholder((M, K), name="A", dtype=dtype)
@@ -84,6 +197,8 @@ def add_common_args(parser):
     parser.add_argument('-N', type=int, default=128)
     parser.add_argument('-ecData', '-D', type=int, default=8)
     parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8',
+                        help='Word type the packets are processed in: uint8, uint32 or uint64')
     parser.add_argument('--log_dir', default='log/bitmatrix.json',
                         help='Directory to save log to')
     parser.add_argument('--tune_num_trials_total', type=int, default=10)
@@ -94,19 +209,52 @@ def add_common_args(parser):
                         default=False, action='store_true')
 
 
+def get_search_task(argv, computation='b', decode=False):
+    """
+    SearchTask of the workload benchmarked for `computation` ("b", "c", "p"
+    or "u") with the geometry in argv, as built by the benchmark functions
+    """
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    dtype = argv.get('dtype', 'uint8')
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    if computation == 'c':
+        assert argv['N'] % argv.get('checksum_width', 64) == 0, "N is not a multiple of the checksum width"
+        func, args = bitmatrix_checksum, (M, argv['N'], K, argv.get('checksum_width', 64), "uint8")
+    elif computation == 'p':
+        func, args = bitmatrix_packed, (M, argv['N'], K, ecW, "uint8")
+    elif computation == 'u':
+        func, args = bitmatrix_delta, (M, argv['N'] // np.dtype(dtype).itemsize, ecW, dtype)
+    elif decode:
+        R = (argv.get('erasures') or ecData) * ecW
+        func, args = bitmatrix, (R, argv['N'] // np.dtype(dtype).itemsize, K, dtype)
+    elif argv.get('batch', 1) > 1:
+        func, args = bitmatrix_batch, (argv['batch'], M, argv['N'], K, "uint8")
+    else:
+        func, args = bitmatrix, (M, argv['N'] // np.dtype(dtype).itemsize, K, dtype)
+    return tvm.auto_scheduler.SearchTask(func=func, args=args, target=target)
+
+
 def benchmark(argv):
     target = get_tvm_target_string()
 
     ecParity = argv['ecParity']
     ecData = argv['ecData']
     ecW = argv['ecW']
-    N = argv['N']
+    dtype = argv.get('dtype', 'uint8')
+    # N is the packet size in bytes, the kernel works on N // itemsize words
+    N = argv['N'] // np.dtype(dtype).itemsize
     M = ecParity * ecW
     K = ecData * ecW
 
     task = tvm.auto_scheduler.SearchTask(
         func=bitmatrix, args=(
-            M, N, K, "uint8"), target=target)
+            M, N, K, dtype), target=target)
 
     log_file = argv['log_file']
     tune_option = auto_scheduler.TuningOptions(
@@ -115,7 +263,11 @@ def benchmark(argv):
         verbose=0,
     )
 
-    task.tune(tune_option)
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
     sch, args = task.apply_best(log_file)
 
     func = tvm.build(sch, args, target)
@@ -126,16 +278,11 @@ def benchmark(argv):
             M,
             ecData)).astype(
                 np.uint8)
-    a_np_expanded = np_expand_bitmatrix(a_np)
+    a_np_expanded = np_expand_bitmatrix(a_np, dtype)
     b_np = np.random.randint(
-        np.iinfo(
-            np.uint8).max,
-        size=(
-            K,
-            N)).astype(
-                np.uint8)
-    # out_np = np_bitmatrix(M, N, K, a_np, b_np)
-    out_np = np.random.uniform(size=(M, N)).astype(np.uint8)
+        np.iinfo(dtype).max,
+        size=(K, N), dtype=dtype)
+    out_np = np_bitmatrix(M, N, K, a_np, b_np)
 
     if argv["export"]:
         export_lib(func, argv["export"])
@@ -143,11 +290,11 @@ def benchmark(argv):
     dev = tvm.cpu()
     a_tvm = tvm.nd.array(a_np_expanded, device=dev)
     b_tvm = tvm.nd.array(b_np, device=dev)
-    out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype="uint8")
+    out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype=dtype)
     func(a_tvm, b_tvm, out_tvm)
 
     # Check results
-    # np.testing.assert_equal(out_np, out_tvm.numpy())
+    np.testing.assert_equal(out_np, out_tvm.numpy())
 
     evaluator = func.time_evaluator(
         func.entry_name, dev, number=1000, repeat=10)
@@ -171,12 +318,15 @@ def benchmark_decode(argv):
 
     ecData = argv['ecData']
     ecW = argv['ecW']
-    N = argv['N']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
     K = ecData * ecW
+    # only the rows of the erased data fragments are decoded
+    R = (argv.get('erasures') or ecData) * ecW
 
     task = tvm.auto_scheduler.SearchTask(
         func=bitmatrix, args=(
-            K, N, K, "uint8"), target=target)
+            R, N, K, dtype), target=target)
 
     log_file = argv['log_file']
     tune_option = auto_scheduler.TuningOptions(
@@ -185,19 +335,155 @@ def benchmark_decode(argv):
         verbose=0,
     )
 
-    task.tune(tune_option)
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
     sch, args = task.apply_best(log_file)
 
     func = tvm.build(sch, args, target)
     a_np = np.random.randint(
         np.iinfo(np.uint8).max,
-        size=(K, ecData)).astype(np.uint8)
+        size=(R, ecData)).astype(np.uint8)
+    a_np_expanded = np_expand_bitmatrix(a_np, dtype)
+    b_np = np.random.randint(
+        np.iinfo(dtype).max,
+        size=(K, N), dtype=dtype)
+    out_np = np_bitmatrix(R, N, K, a_np, b_np)
+
+    if argv["export"]:
+        export_lib(func, argv["export"])
+
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(a_np_expanded, device=dev)
+    b_tvm = tvm.nd.array(b_np, device=dev)
+    out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype=dtype)
+    func(a_tvm, b_tvm, out_tvm)
+
+    # Check results
+    np.testing.assert_equal(out_np, out_tvm.numpy())
+
+    evaluator = func.time_evaluator(
+        func.entry_name, dev, number=1000, repeat=10)
+    ex_time = evaluator(a_tvm, b_tvm, out_tvm).results
+
+    ex_time = np.array(ex_time)
+
+    if argv['bandwidth_size'] == 'f':
+        bandwidth = (a_np.size + b_np.size + out_np.size) * \
+            out_np.itemsize / (1024**2) / ex_time
+    else:
+        bandwidth = (b_np.size) * out_np.itemsize / (1024**2) / ex_time
+
+    del task
+
+    return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
+
+def benchmark_batch(argv):
+    target = get_tvm_target_string()
+
+    batch = argv['batch']
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_batch, args=(
+            batch, M, N, K, "uint8"), target=target)
+
+    log_file = argv['log_file']
+    tune_option = auto_scheduler.TuningOptions(
+        num_measure_trials=argv['tune_num_trials_total'],
+        measure_callbacks=[auto_scheduler.RecordToFile(log_file)],
+        verbose=0,
+    )
+
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
+    sch, args = task.apply_best(log_file)
+
+    func = tvm.build(sch, args, target)
+    a_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(M, ecData)).astype(np.uint8)
+    a_np_expanded = np_expand_bitmatrix(a_np)
+    b_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(batch, K, N)).astype(np.uint8)
+    out_np = np.stack([np_bitmatrix(M, N, K, a_np, stripe) for stripe in b_np])
+
+    if argv["export"]:
+        export_lib(func, argv["export"])
+
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(a_np_expanded, device=dev)
+    b_tvm = tvm.nd.array(b_np, device=dev)
+    out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype="uint8")
+    func(a_tvm, b_tvm, out_tvm)
+
+    # Check results
+    np.testing.assert_equal(out_np, out_tvm.numpy())
+
+    evaluator = func.time_evaluator(
+        func.entry_name, dev, number=100, repeat=10)
+    ex_time = evaluator(a_tvm, b_tvm, out_tvm).results
+
+    ex_time = np.array(ex_time)
+
+    if argv['bandwidth_size'] == 'f':
+        bandwidth = (a_np.size + b_np.size + out_np.size) * \
+            out_np.itemsize / (1024**2) / ex_time
+    else:
+        bandwidth = (b_np.size) * out_np.itemsize / (1024**2) / ex_time
+
+    del task
+
+    return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
+
+def benchmark_checksum(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    L = argv.get('checksum_width', 64)
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_checksum, args=(
+            M, N, K, L, "uint8"), target=target)
+
+    log_file = argv['log_file']
+    tune_option = auto_scheduler.TuningOptions(
+        num_measure_trials=argv['tune_num_trials_total'],
+        measure_callbacks=[auto_scheduler.RecordToFile(log_file)],
+        verbose=0,
+    )
+
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
+    sch, args = task.apply_best(log_file)
+
+    func = tvm.build(sch, args, target)
+    a_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(M, ecData)).astype(np.uint8)
     a_np_expanded = np_expand_bitmatrix(a_np)
     b_np = np.random.randint(
         np.iinfo(np.uint8).max,
         size=(K, N)).astype(np.uint8)
-    # out_np = np_bitmatrix(M, N, K, a_np, b_np)
-    out_np = np.random.uniform(size=(K, N)).astype(np.uint8)
 
     if argv["export"]:
         export_lib(func, argv["export"])
@@ -205,11 +491,79 @@ def benchmark_decode(argv):
     dev = tvm.cpu()
     a_tvm = tvm.nd.array(a_np_expanded, device=dev)
     b_tvm = tvm.nd.array(b_np, device=dev)
+    out_tvm = tvm.nd.empty((M, N), device=dev, dtype="uint8")
+    data_sum_tvm = tvm.nd.empty((K, L), device=dev, dtype="uint8")
+    parity_sum_tvm = tvm.nd.empty((M, L), device=dev, dtype="uint8")
+    func(a_tvm, b_tvm, out_tvm, data_sum_tvm, parity_sum_tvm)
+
+    # Check results
+    np.testing.assert_equal(np_xor_fold(b_np, L), data_sum_tvm.numpy())
+    np.testing.assert_equal(np_xor_fold(out_tvm.numpy(), L), parity_sum_tvm.numpy())
+
+    evaluator = func.time_evaluator(
+        func.entry_name, dev, number=1000, repeat=10)
+    ex_time = evaluator(a_tvm, b_tvm, out_tvm, data_sum_tvm, parity_sum_tvm).results
+
+    ex_time = np.array(ex_time)
+
+    if argv['bandwidth_size'] == 'f':
+        bandwidth = (a_np.size + b_np.size + M * N) * \
+            b_np.itemsize / (1024**2) / ex_time
+    else:
+        bandwidth = (b_np.size) * b_np.itemsize / (1024**2) / ex_time
+
+    del task
+
+    return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
+
+def benchmark_packed(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_packed, args=(
+            M, N, K, ecW, "uint8"), target=target)
+
+    log_file = argv['log_file']
+    tune_option = auto_scheduler.TuningOptions(
+        num_measure_trials=argv['tune_num_trials_total'],
+        measure_callbacks=[auto_scheduler.RecordToFile(log_file)],
+        verbose=0,
+    )
+
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
+    sch, args = task.apply_best(log_file)
+
+    func = tvm.build(sch, args, target)
+    a_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(M, ecData)).astype(np.uint8)
+    b_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(K, N)).astype(np.uint8)
+    out_np = np_bitmatrix(M, N, K, a_np, b_np)
+
+    if argv["export"]:
+        export_lib(func, argv["export"])
+
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(a_np, device=dev)
+    b_tvm = tvm.nd.array(b_np, device=dev)
     out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype="uint8")
     func(a_tvm, b_tvm, out_tvm)
 
     # Check results
-    # np.testing.assert_equal(out_np, out_tvm.numpy())
+    np.testing.assert_equal(out_np, out_tvm.numpy())
 
     evaluator = func.time_evaluator(
         func.entry_name, dev, number=1000, repeat=10)
@@ -227,28 +581,123 @@ def benchmark_decode(argv):
 
     return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
 
+def benchmark_delta(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecW = argv['ecW']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
+    M = ecParity * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_delta, args=(
+            M, N, ecW, dtype), target=target)
+
+    log_file = argv['log_file']
+    tune_option = auto_scheduler.TuningOptions(
+        num_measure_trials=argv['tune_num_trials_total'],
+        measure_callbacks=[auto_scheduler.RecordToFile(log_file)],
+        verbose=0,
+    )
+
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
+    sch, args = task.apply_best(log_file)
+
+    func = build_in_place(sch, args, target)
+    a_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(M, 1)).astype(np.uint8)
+    a_np_expanded = np_expand_bitmatrix(a_np, dtype)
+    old_np = np.random.randint(
+        np.iinfo(dtype).max,
+        size=(ecW, N), dtype=dtype)
+    new_np = np.random.randint(
+        np.iinfo(dtype).max,
+        size=(ecW, N), dtype=dtype)
+    p_np = np.random.randint(
+        np.iinfo(dtype).max,
+        size=(M, N), dtype=dtype)
+    out_np = p_np ^ np_bitmatrix(M, N, ecW, a_np, old_np ^ new_np)
+
+    if argv["export"]:
+        export_lib(func, argv["export"])
+
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(a_np_expanded, device=dev)
+    old_tvm = tvm.nd.array(old_np, device=dev)
+    new_tvm = tvm.nd.array(new_np, device=dev)
+    p_tvm = tvm.nd.array(p_np, device=dev)
+    out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype=dtype)
+    func(a_tvm, old_tvm, new_tvm, p_tvm, out_tvm)
+
+    # Check results, with a separate and with an aliased output
+    np.testing.assert_equal(out_np, out_tvm.numpy())
+    inplace_tvm = tvm.nd.array(p_np, device=dev)
+    func(a_tvm, old_tvm, new_tvm, inplace_tvm, inplace_tvm)
+    np.testing.assert_equal(out_np, inplace_tvm.numpy())
+
+    evaluator = func.time_evaluator(
+        func.entry_name, dev, number=1000, repeat=10)
+    ex_time = evaluator(a_tvm, old_tvm, new_tvm, p_tvm, out_tvm).results
+
+    ex_time = np.array(ex_time)
+
+    # bandwidth is counted on the rewritten fragment
+    if argv['bandwidth_size'] == 'f':
+        bandwidth = (a_np_expanded.size + old_np.size + new_np.size + 2 * p_np.size) * \
+            out_np.itemsize / (1024**2) / ex_time
+    else:
+        bandwidth = (new_np.size) * out_np.itemsize / (1024**2) / ex_time
+
+    del task
+
+    return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
+
+def has_record(log_file, task):
+    return os.path.exists(log_file) and \
+        auto_scheduler.load_best_record(log_file, task.workload_key)[0] is not None
+
+def default_schedule(task):
+    return task.compute_dag.apply_steps_from_state(task.compute_dag.get_init_state())
+
+def apply_best_or_default(task, log_file):
+    """
+    task.apply_best from log_file, or the default (untuned) schedule when
+    log_file is None. A log without a record for the task is an error, so an
+    untuned kernel is never reported as the tuned one.
+    """
+    if log_file is None:
+        return default_schedule(task)
+    if not has_record(log_file, task):
+        raise ValueError("%s has no record for workload %s" % (log_file, task.workload_key))
+    return task.apply_best(log_file)
+
 def get_best_as_func(argv):
     target = get_tvm_target_string()
 
     ecParity = argv['ecParity']
     ecData = argv['ecData']
     ecW = argv['ecW']
-    N = argv['N']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
     M = ecParity * ecW
     K = ecData * ecW
 
     task = tvm.auto_scheduler.SearchTask(
         func=bitmatrix, args=(
-            M, N, K, "uint8"), target=target)
+            M, N, K, dtype), target=target)
     
     # Inspect the computational graph
     if argv['verbose'] >= 1:
         print("Computational DAG:")
         print(task.compute_dag)
 
-    log_file = argv['log_file']
-
-    sch, args = task.apply_best(log_file)
+    sch, args = apply_best_or_default(task, argv['log_file'])
 
     if argv['verbose'] >= 1:
         print("Lowered TIR:")
@@ -257,35 +706,44 @@ def get_best_as_func(argv):
     func = tvm.build(sch, args, target)
     return func
 
+def get_cached_func(argv):
+    """
+    Same as get_best_as_func, but reuses a kernel compiled earlier for the
+    same code geometry, target and tuning log
+    """
+    target = get_tvm_target_string()
+    key = (argv['ecParity'], argv['ecData'], argv['ecW'], argv['N'],
+           argv.get('dtype', 'uint8'), target,
+           log_file_stamp(argv['log_file']))
+    return get_kernel('bitmatrix', key, lambda: get_best_as_func(argv),
+                      argv.get('cache_dir'))
+
 def get_best_benchmark(argv):
     func = get_best_as_func(argv)
 
     ecParity = argv['ecParity']
     ecData = argv['ecData']
     ecW = argv['ecW']
-    N = argv['N']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
     M = ecParity * ecW
     K = ecData * ecW
     input_bitmatrix = argv['input_bitmatrix']
 
     print(input_bitmatrix)
     if input_bitmatrix:
-        with open(input_bitmatrix) as f:
-            a_np_expanded = [[int(x) for x in line[:-1].split(' ')] for line in f.read().splitlines()]
-        a_np_expanded = np.array(a_np_expanded)
-        a_np_expanded = np.where(a_np_expanded == 0, 0, ~0).astype(np.uint8)
+        a_np_expanded = np_fill_bitmatrix(load_bitmatrix(input_bitmatrix), dtype)
     else:
         a_np = np.random.randint(
             np.iinfo(np.uint8).max,
             size=(M, ecData)).astype(np.uint8)
-        a_np_expanded = np_expand_bitmatrix(a_np)
+        a_np_expanded = np_expand_bitmatrix(a_np, dtype)
     print(a_np_expanded.shape)
     print(a_np_expanded)
     b_np = np.random.randint(
-        np.iinfo(np.uint8).max,
-        size=(K, N)).astype(np.uint8)
-    # out_np = np_bitmatrix(M, N, K, a_np, b_np)
-    out_np = np.random.uniform(size=(M, N)).astype(np.uint8)
+        np.iinfo(dtype).max,
+        size=(K, N), dtype=dtype)
+    out_np = np_bitmatrix_multiply(a_np_expanded, b_np)
 
     if argv["export"]:
         export_lib(func, argv["export"])
@@ -293,11 +751,11 @@ def get_best_benchmark(argv):
     dev = tvm.cpu()
     a_tvm = tvm.nd.array(a_np_expanded, device=dev)
     b_tvm = tvm.nd.array(b_np, device=dev)
-    out_tvm = tvm.nd.empty(out_np.shape, dtype="uint8", device=dev)
+    out_tvm = tvm.nd.empty(out_np.shape, dtype=dtype, device=dev)
     func(a_tvm, b_tvm, out_tvm)
 
     # Check results
-    # np.testing.assert_equal(out_np, out_tvm.numpy())
+    np.testing.assert_equal(out_np, out_tvm.numpy())
 
     evaluator = func.time_evaluator(
         func.entry_name, dev, number=1000, repeat=10)
@@ -312,24 +770,41 @@ def get_best_benchmark(argv):
         bandwidth = (b_np.size) * out_np.itemsize / (1024**2) / ex_time
     return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
 
-# def get_best_decode_as_func(argv):
-#     target = get_tvm_target_string()
+def get_best_decode_as_func(argv):
+    """
+    Build the (R, K) x (K, N) decode kernel, R being the rows of
+    argv['erasures'] data fragments (all of them by default), from its tuning
+    log, or with the default schedule when the log has no record for it
+    """
+    target = get_tvm_target_string()
 
-#     ecData = argv['ecData']
-#     ecW = argv['ecW']
-#     N = argv['N']
-#     K = ecData * ecW
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
+    K = ecData * ecW
+    R = (argv.get('erasures') or ecData) * ecW
 
-#     task = tvm.auto_scheduler.SearchTask(
-#         func=bitmatrix, args=(
-#             K, N, K, "uint8"), target=target)
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix, args=(
+            R, N, K, dtype), target=target)
 
-#     log_file = argv['log_file']
+    log_file = argv['log_file']
 
-#     sch, args = task.apply_best(log_file)
+    if log_file and has_record(log_file, task):
+        sch, args = task.apply_best(log_file)
+    else:
+        sch, args = default_schedule(task)
 
-#     func = tvm.build(sch, args, target)
-#     return func
+    func = tvm.build(sch, args, target)
+    return func
+
+def get_cached_decode_func(argv):
+    target = get_tvm_target_string()
+    key = (argv['ecData'], argv['ecW'], argv['N'], argv.get('erasures') or argv['ecData'],
+           argv.get('dtype', 'uint8'), target, log_file_stamp(argv['log_file']))
+    return get_kernel('bitmatrix_decode', key, lambda: get_best_decode_as_func(argv),
+                      argv.get('cache_dir'))
 
 # def get_best_benchmark_decode(argv):
 #     func = get_best_benchmark_as_func(argv)
@@ -368,7 +843,131 @@ def get_best_benchmark(argv):
 #         bandwidth = (b_np.size) * out_np.itemsize / (1024**2) / ex_time
 #     return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
 
-def bitmatrix_multiply(argv, encoder, data):
+def get_best_batch_as_func(argv):
+    target = get_tvm_target_string()
+
+    batch = argv['batch']
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_batch, args=(
+            batch, M, N, K, "uint8"), target=target)
+
+    sch, args = task.apply_best(argv['log_file'])
+
+    func = tvm.build(sch, args, target)
+    return func
+
+def get_cached_batch_func(argv):
+    target = get_tvm_target_string()
+    key = (argv['batch'], argv['ecParity'], argv['ecData'], argv['ecW'], argv['N'], target,
+           log_file_stamp(argv['log_file']))
+    return get_kernel('bitmatrix_batch', key, lambda: get_best_batch_as_func(argv),
+                      argv.get('cache_dir'))
+
+def get_best_checksum_as_func(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    L = argv.get('checksum_width', 64)
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_checksum, args=(
+            M, N, K, L, "uint8"), target=target)
+
+    sch, args = task.apply_best(argv['log_file'])
+
+    func = tvm.build(sch, args, target)
+    return func
+
+def get_cached_checksum_func(argv):
+    target = get_tvm_target_string()
+    key = (argv['ecParity'], argv['ecData'], argv['ecW'], argv['N'],
+           argv.get('checksum_width', 64), target, log_file_stamp(argv['log_file']))
+    return get_kernel('bitmatrix_checksum', key, lambda: get_best_checksum_as_func(argv),
+                      argv.get('cache_dir'))
+
+def get_best_packed_as_func(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_packed, args=(
+            M, N, K, ecW, "uint8"), target=target)
+
+    sch, args = apply_best_or_default(task, argv['log_file'])
+
+    func = tvm.build(sch, args, target)
+    return func
+
+def get_cached_packed_func(argv):
+    target = get_tvm_target_string()
+    key = (argv['ecParity'], argv['ecData'], argv['ecW'], argv['N'], target,
+           log_file_stamp(argv['log_file']))
+    return get_kernel('bitmatrix_packed', key, lambda: get_best_packed_as_func(argv),
+                      argv.get('cache_dir'))
+
+def get_best_delta_as_func(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecW = argv['ecW']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
+    M = ecParity * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix_delta, args=(
+            M, N, ecW, dtype), target=target)
+
+    sch, args = apply_best_or_default(task, argv['log_file'])
+
+    func = build_in_place(sch, args, target)
+    return func
+
+def get_cached_delta_func(argv):
+    target = get_tvm_target_string()
+    # kernels from before build_in_place assumed no aliasing, never reuse them
+    key = (argv['ecParity'], argv['ecW'], argv['N'], argv.get('dtype', 'uint8'), target,
+           log_file_stamp(argv['log_file']), 'in_place')
+    return get_kernel('bitmatrix_delta', key, lambda: get_best_delta_as_func(argv),
+                      argv.get('cache_dir'))
+
+def _run_into(func, a_tvm, b_tvm, out, dev, *extra):
+    if is_zero_copy(out):
+        func(a_tvm, b_tvm, tvm.nd.from_dlpack(out), *extra)
+    else:
+        out_tvm = tvm.nd.empty(out.shape, dtype=str(out.dtype), device=dev)
+        func(a_tvm, b_tvm, out_tvm, *extra)
+        out[...] = out_tvm.numpy()
+    return out
+
+def bitmatrix_multiply(argv, encoder, data, out=None):
+    """
+    Multiply data by the encoder bitmatrix, writing the parity into out
+
+    Aligned, C-contiguous, writeable buffers (see common.aligned_empty) are
+    passed to the kernel without copies. data and out stay uint8 (K, N) and
+    (M, N) byte matrices, they are reinterpreted as argv['dtype'] words.
+    encoder holds 0 / ~0 masks, filled in argv['dtype'] to avoid a
+    conversion per call.
+    """
     ecParity = argv['ecParity']
     ecData = argv['ecData']
     ecW = argv['ecW']
@@ -378,13 +977,211 @@ def bitmatrix_multiply(argv, encoder, data):
     assert encoder.shape == (M, K)
     assert data.shape == (K, N)
     dev = tvm.cpu()
-    func = get_best_as_func(argv)
-    a_tvm = tvm.nd.array(encoder, device=dev)
-    b_tvm = tvm.nd.array(data, device=dev)
-    out_tvm = tvm.nd.empty((M, N), dtype="uint8", device=dev)
-    func(a_tvm, b_tvm, out_tvm)
+    dtype = argv.get('dtype', 'uint8')
+    func = get_cached_func(argv)
+    if out is None:
+        out = aligned_empty((M, N))
+    assert out.shape == (M, N)
+    a_tvm = as_tvm_array(as_mask_words(encoder, dtype), dev)
+    b_tvm = as_tvm_array(as_words(data, dtype), dev)
+
+    _run_into(func, a_tvm, b_tvm, as_words(out, dtype), dev)
+    return out
+
+def bitmatrix_decode(argv, decoder, data, out=None):
+    """
+    Multiply the (K, N) surviving data by an (R, K) decoder bitmatrix, R
+    being the rows of argv['erasures'] data fragments (all by default)
+    """
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    K = ecData * ecW
+    R = (argv.get('erasures') or ecData) * ecW
+    assert decoder.shape == (R, K)
+    assert data.shape == (K, N)
+    dev = tvm.cpu()
+    dtype = argv.get('dtype', 'uint8')
+    func = get_cached_decode_func(argv)
+    if out is None:
+        out = aligned_empty((R, N))
+    assert out.shape == (R, N)
+    a_tvm = as_tvm_array(as_mask_words(decoder, dtype), dev)
+    b_tvm = as_tvm_array(as_words(data, dtype), dev)
+
+    _run_into(func, a_tvm, b_tvm, as_words(out, dtype), dev)
+    return out
+
+def bitmatrix_multiply_packed(argv, encoder, data, out=None):
+    """
+    bitmatrix_multiply taking the (M, ecData) bit-packed encoder
+    """
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+    assert ecW == 8, "packed bitmatrices hold one uint8 per fragment"
+    assert encoder.shape == (M, ecData)
+    assert data.shape == (K, N)
+    dev = tvm.cpu()
+    func = get_cached_packed_func(argv)
+    if out is None:
+        out = aligned_empty((M, N))
+    assert out.shape == (M, N)
+
+    return _run_into(func, as_tvm_array(encoder, dev), as_tvm_array(data, dev), out, dev)
+
+def bitmatrix_update(argv, columns, old, new, parity):
+    """
+    XOR columns * (old ^ new) into parity in place, columns being the
+    (M, ecW) encoder columns of the rewritten (ecW, N) data fragment
+    """
+    ecParity = argv['ecParity']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    dtype = argv.get('dtype', 'uint8')
+    assert columns.shape == (M, ecW)
+    assert old.shape == (ecW, N) and new.shape == (ecW, N)
+    assert parity.shape == (M, N)
+    dev = tvm.cpu()
+    func = get_cached_delta_func(argv)
+    a_tvm = as_tvm_array(as_mask_words(columns, dtype), dev)
+    old_tvm = as_tvm_array(as_words(old, dtype), dev)
+    new_tvm = as_tvm_array(as_words(new, dtype), dev)
+    words = as_words(parity, dtype)
+    if is_zero_copy(words):
+        p_tvm = tvm.nd.from_dlpack(words)
+        func(a_tvm, old_tvm, new_tvm, p_tvm, p_tvm)
+    else:
+        p_tvm = tvm.nd.array(words, device=dev)
+        func(a_tvm, old_tvm, new_tvm, p_tvm, p_tvm)
+        words[...] = p_tvm.numpy()
+    return parity
+
+def bitmatrix_multiply_checksum(argv, encoder, data, out=None):
+    """
+    Encode data and checksum every data and parity packet in one kernel call,
+    the data being reduced twice unless the schedule fuses the stages
+
+    Returns (parity, data_sum, parity_sum), the sums being the (K, L) and
+    (M, L) XOR-folds of the rows (see common.np_xor_fold and
+    common.np_fragment_checksums).
+    """
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    L = argv.get('checksum_width', 64)
+    M = ecParity * ecW
+    K = ecData * ecW
+    assert encoder.shape == (M, K)
+    assert data.shape == (K, N)
+    assert N % L == 0, "N (%d) is not a multiple of the checksum width %d" % (N, L)
+    dev = tvm.cpu()
+    func = get_cached_checksum_func(argv)
+    if out is None:
+        out = aligned_empty((M, N))
+    assert out.shape == (M, N)
+    data_sum = aligned_empty((K, L))
+    parity_sum = aligned_empty((M, L))
+    _run_into(func, as_tvm_array(encoder, dev), as_tvm_array(data, dev), out, dev,
+              tvm.nd.from_dlpack(data_sum), tvm.nd.from_dlpack(parity_sum))
+
+    return out, data_sum, parity_sum
+
+def bitmatrix_multiply_batch(argv, encoder, data, out=None):
+    """
+    Encode many stripes with the batched kernel, argv['batch'] stripes per call
+
+    data is (n, K, N) or a list of n (K, N) stripes, the parity is returned
+    as (n, M, N). A trailing partial batch is zero padded.
+    """
+    batch = argv['batch']
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+    assert encoder.shape == (M, K)
+    if not isinstance(data, np.ndarray):
+        stripes = data
+        data = aligned_empty((len(stripes), K, N))
+        for b, stripe in enumerate(stripes):
+            data[b] = stripe
+    assert data.shape[1:] == (K, N)
+    n = data.shape[0]
+    if out is None:
+        out = aligned_empty((n, M, N))
+    assert out.shape == (n, M, N)
+
+    dev = tvm.cpu()
+    func = get_cached_batch_func(argv)
+    a_tvm = as_tvm_array(as_mask_words(encoder, 'uint8'), dev)
+    for start in range(0, n, batch):
+        stop = min(start + batch, n)
+        if stop - start == batch:
+            _run_into(func, a_tvm, as_tvm_array(data[start:stop], dev), out[start:stop], dev)
+        else:
+            chunk = aligned_empty((batch, K, N))
+            chunk[:stop - start] = data[start:stop]
+            chunk[stop - start:] = 0
+            parity = _run_into(func, a_tvm, as_tvm_array(chunk, dev),
+                               aligned_empty((batch, M, N)), dev)
+            out[start:stop] = parity[:stop - start]
+
+    return out
+
+def get_best_benchmark_zero_copy(argv):
+    """
+    Time bitmatrix_multiply-style calls with and without the host copies
+
+    Returns the per call time (s) and bandwidth (MB/s) of the copying path
+    (tvm.nd.array in, .numpy() out) and of the zero-copy path.
+    """
+    func = get_cached_func(argv)
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+    number = argv.get('number', 1000)
+
+    a_np = np_expand_bitmatrix(np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(M, ecData)).astype(np.uint8))
+    b_np = aligned_empty((K, N))
+    b_np[...] = np.random.randint(np.iinfo(np.uint8).max, size=(K, N))
+    out_np = aligned_empty((M, N))
+
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(a_np, device=dev)
 
-    return out_tvm.numpy()
+    def copy_call():
+        out_tvm = tvm.nd.empty((M, N), dtype="uint8", device=dev)
+        func(a_tvm, tvm.nd.array(b_np, device=dev), out_tvm)
+        return out_tvm.numpy()
+
+    def zero_copy_call():
+        func(a_tvm, tvm.nd.from_dlpack(b_np), tvm.nd.from_dlpack(out_np))
+        return out_np
+
+    np.testing.assert_equal(copy_call(), zero_copy_call())
+
+    result = {}
+    for name, call in (('copy', copy_call), ('zero_copy', zero_copy_call)):
+        call()
+        tic = time.perf_counter()
+        for _ in range(number):
+            call()
+        ex_time = (time.perf_counter() - tic) / number
+        result[name] = (ex_time, b_np.size * b_np.itemsize / (1024**2) / ex_time)
+    return result
 
 def main():
     parser = argparse.ArgumentParser()
@@ -396,17 +1193,18 @@ def main():
     ecParity = argv.ecParity
     ecData = argv.ecData
     ecW = argv.ecW
-    N = argv.N
+    dtype = argv.dtype
+    N = argv.N // np.dtype(dtype).itemsize
     M = ecParity * ecW
     K = ecData * ecW
 
     if argv.print_basic:
-        print_basic_schedule(M, N, K, "uint8")
+        print_basic_schedule(M, N, K, dtype)
         exit(0)
 
     task = tvm.auto_scheduler.SearchTask(
         func=bitmatrix, args=(
-            M, N, K, "uint8"), target=target)
+            M, N, K, dtype), target=target)
 
     # Inspect the computational graph
     print("Computational DAG:")
@@ -429,16 +1227,16 @@ def main():
     a_np = np.random.randint(
         np.iinfo(np.uint8).max,
         size=(M, ecData)).astype(np.uint8)
-    a_np_expanded = np_expand_bitmatrix(a_np)
+    a_np_expanded = np_expand_bitmatrix(a_np, dtype)
     b_np = np.random.randint(
-        np.iinfo(np.uint8).max,
-        size=(K, N)).astype(np.uint8)
+        np.iinfo(dtype).max,
+        size=(K, N), dtype=dtype)
     out_np = np_bitmatrix(M, N, K, a_np, b_np)
 
     dev = tvm.cpu()
     a_tvm = tvm.nd.array(a_np_expanded, device=dev)
     b_tvm = tvm.nd.array(b_np, device=dev)
-    out_tvm = tvm.nd.empty(out_np.shape, dtype="uint8", device=dev)
+    out_tvm = tvm.nd.empty(out_np.shape, dtype=dtype, device=dev)
     func(a_tvm, b_tvm, out_tvm)
 
     # Check results
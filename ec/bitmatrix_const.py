@@ -0,0 +1,192 @@
+"""
+Bitmatrix kernels specialized on a constant encoding bitmatrix
+
+The bitmatrix is baked into the compute definition, so only the XORs of the
+nonzero entries are emitted (no AND with a runtime mask), and the rows can
+share common XOR subexpressions found greedily in the style of XOR-SLP.
+"""
+
+import argparse
+import hashlib
+import operator
+from functools import reduce
+import numpy as np
+import tvm
+from tvm import te
+from bitmatrix_autoschedule import get_cached_func
+from common import get_tvm_target_string, load_bitmatrix, np_fill_bitmatrix
+from common import aligned_empty, as_tvm_array, is_zero_copy
+from kernel_cache import get_kernel
+
+
+def xor_schedule(bitmatrix, cse=True):
+    """
+    Greedy XOR program for a 0/1 bitmatrix
+
+    Returns (temps, rows). Variables 0..K-1 are the data rows, variable K + t
+    is temps[t] = (a, b), the XOR of variables a and b. Output row i is the
+    XOR of the variables in rows[i]. With cse set, the pair of variables
+    shared by the most rows is factored out until no pair is shared twice.
+    """
+    R = (bitmatrix != 0).astype(np.int32)
+    temps = []
+    while cse:
+        C = np.triu(R.T @ R, 1)
+        a, b = np.unravel_index(np.argmax(C), C.shape)
+        if C[a, b] < 2:
+            break
+        both = (R[:, a] & R[:, b]).astype(bool)
+        R[both, a] = 0
+        R[both, b] = 0
+        R = np.concatenate((R, both[:, np.newaxis].astype(np.int32)), axis=1)
+        temps.append((int(a), int(b)))
+    rows = [np.nonzero(r)[0].tolist() for r in R]
+    return temps, rows
+
+
+def xor_count(temps, rows):
+    return len(temps) + sum(max(len(r) - 1, 0) for r in rows)
+
+
+def bitmatrix_const(bitmatrix, N, dtype="uint8", cse=True):
+    """
+    One output tensor of shape (N,) per bitmatrix row, all computed in the
+    same loop so shared subexpressions are evaluated once per element
+    """
+    M, K = bitmatrix.shape
+    temps, rows = xor_schedule(bitmatrix, cse)
+    B = te.placeholder((K, N), name="B", dtype=dtype)
+
+    def fcompute(j):
+        v = [B[k, j] for k in range(K)]
+        for a, b in temps:
+            v.append(v[a] ^ v[b])
+        outs = []
+        for r in rows:
+            if r:
+                outs.append(reduce(operator.xor, [v[x] for x in r]))
+            else:
+                outs.append(tvm.tir.const(0, dtype))
+        return outs
+
+    outs = te.compute((N,), fcompute, name="bitmul")
+    if not isinstance(outs, (list, tuple)):
+        outs = [outs]
+    return [B] + list(outs)
+
+
+def get_const_func(bitmatrix, N, cse=True, vector=64, dtype="uint8"):
+    """
+    Compile (or fetch from the kernel cache) the kernel for a constant
+    bitmatrix. The outer loop runs in parallel, the inner `vector` elements
+    are vectorized.
+    """
+    target = get_tvm_target_string()
+
+    def build():
+        args = bitmatrix_const(bitmatrix, N, dtype, cse)
+        op = args[1].op
+        s = te.create_schedule(op)
+        jo, ji = s[op].split(op.axis[0], factor=vector)
+        s[op].parallel(jo)
+        s[op].vectorize(ji)
+        return tvm.build(s, args, target)
+
+    digest = hashlib.sha1(np.packbits(bitmatrix != 0, axis=1).tobytes()).hexdigest()
+    key = (bitmatrix.shape, digest, N, cse, vector, dtype, target)
+    return get_kernel('bitmatrix_const', key, build)
+
+
+def const_args(data, out, dev):
+    """
+    Kernel arguments: the data followed by one (N,) view per parity row
+    """
+    rows = [as_tvm_array(out[i], dev) for i in range(out.shape[0])]
+    return [as_tvm_array(data, dev)] + rows
+
+
+def bitmatrix_multiply_const(bitmatrix, data, out=None, cse=True, vector=64):
+    """
+    Multiply data by a constant 0/1 bitmatrix with the specialized kernel
+    """
+    M, K = bitmatrix.shape
+    N = data.shape[1]
+    assert data.shape == (K, N)
+    func = get_const_func(bitmatrix, N, cse, vector, str(data.dtype))
+    if out is None:
+        out = aligned_empty((M, N), data.dtype)
+    assert out.shape == (M, N)
+    dev = tvm.cpu()
+    args = const_args(data, out, dev)
+    func(*args)
+    for i in range(M):
+        if not is_zero_copy(out[i]):
+            out[i] = args[1 + i].numpy()
+    return out
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, default=4)
+    parser.add_argument('-N', type=int, default=128000)
+    parser.add_argument('-ecData', '-D', type=int, default=10)
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--input_bitmatrix', default='xorslp_enc_matrix/rs_10_4.txt', type=str)
+    parser.add_argument('--read_log_file', default=None,
+                        help='Tuned schedule of the generic kernel to compare against')
+    parser.add_argument('--vector', type=int, default=64,
+                        help='Number of elements per vectorized inner loop')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    bitmatrix = load_bitmatrix(argv.input_bitmatrix)
+    M, K = bitmatrix.shape
+    N = argv.N
+    assert (M, K) == (argv.ecParity * argv.ecW, argv.ecData * argv.ecW)
+
+    dev = tvm.cpu()
+    b_np = aligned_empty((K, N))
+    b_np[...] = np.random.randint(np.iinfo(np.uint8).max, size=(K, N))
+    results = {}
+
+    for cse in (False, True):
+        name = 'const_cse' if cse else 'const'
+        print("%s: %d XORs per element" % (name, xor_count(*xor_schedule(bitmatrix, cse))))
+        func = get_const_func(bitmatrix, N, cse, argv.vector)
+        out_np = aligned_empty((M, N))
+        args = const_args(b_np, out_np, dev)
+        func(*args)
+        results[name] = (func, args, out_np)
+
+    np.testing.assert_equal(results['const'][2], results['const_cse'][2])
+
+    if argv.read_log_file:
+        a = {
+            'ecParity': argv.ecParity,
+            'N': N,
+            'ecData': argv.ecData,
+            'ecW': argv.ecW,
+            'log_file': argv.read_log_file,
+            'verbose': 0,
+        }
+        func = get_cached_func(a)
+        out_tvm = tvm.nd.empty((M, N), dtype="uint8", device=dev)
+        args = [tvm.nd.array(np_fill_bitmatrix(bitmatrix), device=dev),
+                as_tvm_array(b_np, dev), out_tvm]
+        func(*args)
+        np.testing.assert_equal(results['const'][2], out_tvm.numpy())
+        results['generic'] = (func, args, None)
+
+    for name, (func, args, _) in results.items():
+        evaluator = func.time_evaluator(func.entry_name, dev, number=1000, repeat=10)
+        ex_time = np.array(evaluator(*args).results)
+        bandwidth = b_np.size * b_np.itemsize / (1024**2) / ex_time
+        print("%s: %.6f s, %.3f MB/s (std %.3f)"
+              % (name, np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth)))
+
+
+if __name__ == '__main__':
+    main()
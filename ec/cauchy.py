@@ -0,0 +1,79 @@
+"""
+Low-density Cauchy encoder bitmatrices report
+
+Compares the encoders found by galois_field.search_cauchy with the baseline
+bitmatrices: ones, naive and CSE XOR counts (bitmatrix_const), and with
+--measure the time ratio of their constant-bitmatrix kernels.
+"""
+
+import argparse
+import os
+import numpy as np
+import tvm
+from pyfinite.rs_code import RSCode
+from bitmatrix_const import get_const_func, const_args, xor_schedule, xor_count
+from common import load_bitmatrix, aligned_empty
+from galois_field import get_cauchy_bitmatrix
+
+
+def naive_xor_count(bitmatrix):
+    return int(np.maximum((bitmatrix != 0).sum(axis=1) - 1, 0).sum())
+
+
+def measure_speedup(baseline, best, N, number=100):
+    """
+    Time ratio of the constant-bitmatrix kernels of the two encoders
+    """
+    K = baseline.shape[1]
+    dev = tvm.cpu()
+    data = aligned_empty((K, N))
+    data[...] = np.random.randint(np.iinfo(np.uint8).max, size=(K, N))
+    times = []
+    for bitmatrix in (baseline, best):
+        func = get_const_func(bitmatrix, N)
+        args = const_args(data, aligned_empty((bitmatrix.shape[0], N)), dev)
+        evaluator = func.time_evaluator(func.entry_name, dev, number=number, repeat=10)
+        times.append(np.mean(evaluator(*args).results))
+    return times[0] / times[1]
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, nargs='+', default=[2, 3, 4])
+    parser.add_argument('-ecData', '-D', type=int, nargs='+', default=[8, 9, 10])
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('-N', type=int, default=128000)
+    parser.add_argument('--trials', type=int, default=200,
+                        help='Number of random Cauchy element choices tried per code')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline_dir', default='xorslp_enc_matrix/',
+                        help='Directory of rs_<D>_<P>.txt bitmatrices to compare against, '
+                             'pyfinite encoders are used for the missing ones')
+    parser.add_argument('--measure', action='store_true',
+                        help='Also time the constant-bitmatrix kernels of both encoders')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    for ecParity in argv.ecParity:
+        for ecData in argv.ecData:
+            path = os.path.join(argv.baseline_dir, 'rs_%d_%d.txt' % (ecData, ecParity))
+            if os.path.exists(path):
+                baseline = load_bitmatrix(path)
+            else:
+                baseline = np.array(RSCode(ecData, ecParity).CreateEncoderBitMatrix(argv.ecW)).astype(np.uint8)
+            best = get_cauchy_bitmatrix(ecParity, ecData, argv.ecW, argv.trials, argv.seed)
+
+            line = "P=%d D=%d: ones %d -> %d, XORs %d -> %d, with CSE %d -> %d" % (
+                ecParity, ecData, baseline.sum(), best.sum(),
+                naive_xor_count(baseline), naive_xor_count(best),
+                xor_count(*xor_schedule(baseline)), xor_count(*xor_schedule(best)))
+            if argv.measure:
+                line += ", speedup %.3fx" % measure_speedup(baseline, best, argv.N)
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
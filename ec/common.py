@@ -2,63 +2,199 @@
 Utility scripts
 """
 
+import os
+import functools
+import json
+import platform
 import psutil
 import subprocess
 import numpy as np
+import tvm
 from pathlib import Path
+from kernel_cache import get_cache_dir
 
+# TVM kernels assume their buffers are aligned to this many bytes
+TVM_ALIGNMENT = 64
 
-def get_tvm_target_string():
+
+def get_host_id():
+    """
+    Identify the host CPU model, the key of the on-disk target cache
+    """
+    model = ''
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return platform.machine() + ' ' + model
+
+
+def detect_host_cpu():
     """
-    Get the target string to be used in TVM
+    LLVM name of the host CPU, asked to TVM or, with an older libtvm, llc
     """
+    try:
+        return str(tvm.target.codegen.llvm_get_system_cpu())
+    except AttributeError:
+        # libtvm (or tvm) without target.llvm_get_system_cpu
+        pass
     llc_process = subprocess.Popen(('llc', '--version'), stdout=subprocess.PIPE)
     output = subprocess.check_output(('grep', 'Host CPU'), stdin=llc_process.stdout, universal_newlines=True)
     llc_process.wait()
-    cpu_str = output.split()[-1]
-    ncore = psutil.cpu_count() // 2
-    tgt_string = 'llvm -mcpu=' + cpu_str + ' -num-cores ' + str(ncore)
+    return output.split()[-1]
+
+
+@functools.lru_cache(maxsize=None)
+def get_host_cpu():
+    """
+    detect_host_cpu memoized per process and in the kernel cache directory,
+    TVM_EC_MCPU overrides it
+    """
+    cpu = os.environ.get('TVM_EC_MCPU')
+    if cpu:
+        return cpu
+    path = get_cache_dir() / 'host_cpu.json'
+    host = get_host_id()
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if host in cache:
+        return cache[host]
+    cpu = detect_host_cpu()
+    cache[host] = cpu
+    try:
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = path.with_name(path.name + '.' + str(os.getpid()) + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return cpu
+
+
+def get_tvm_target_string():
+    """
+    Get the target string to be used in TVM, TVM_EC_TARGET overrides it.
+    -num-cores is half the logical cpus unless TVM_EC_NUM_CORES is set.
+    """
+    target = os.environ.get('TVM_EC_TARGET')
+    if target:
+        return target
+    ncore = int(os.environ.get('TVM_EC_NUM_CORES', max(1, psutil.cpu_count() // 2)))
+    tgt_string = 'llvm -mcpu=' + get_host_cpu() + ' -num-cores ' + str(ncore)
     return tgt_string
 
 
-def np_expand_bitmatrix(A):
+def np_expand_bitmatrix(A, dtype=None):
+    """
+    Expand every bit of A (most significant first) into a 0 / ~0 mask element
+    of dtype (A's dtype by default)
+    """
     ecW = A.itemsize*8
-    A_expand = np.zeros((A.shape[0], A.shape[1]*ecW)).astype(A.dtype)
-    
-    for i in range(A_expand.shape[0]):
-        for j in range(A_expand.shape[1]):
-            tar = A[i, j//ecW]
-            idx = j%ecW
-            interm = tar & (1 << (ecW - idx - 1))
-            if interm > 0:
-                A_expand[i, j] = ~0
-            else:
-                A_expand[i, j] = 0
-    
-    return A_expand
+    if A.dtype == np.uint8:
+        bits = np.unpackbits(A, axis=1)
+    else:
+        shifts = np.arange(ecW - 1, -1, -1, dtype=A.dtype)
+        bits = (A[:, :, np.newaxis] >> shifts) & 1
+    bits = bits.reshape(A.shape[0], A.shape[1]*ecW)
+    return np_fill_bitmatrix(bits, A.dtype if dtype is None else dtype)
+
+def np_pack_bitmatrix(A):
+    """
+    Inverse of np_expand_bitmatrix for uint8: pack a 0/1 (or 0 / ~0)
+    bitmatrix 8 columns per byte, most significant bit first
+    """
+    return np.packbits(A != 0, axis=1)
 
 # convert the 1s in a bitmatrix to ~0
-def np_fill_bitmatrix(A):
-    ecW = A.itemsize*8
-    A_expand = np.zeros((A.shape[0], A.shape[1])).astype(A.dtype)
-    
-    for i in range(A_expand.shape[0]):
-        for j in range(A_expand.shape[1]):
-            if A[i, j] > 0:
-                A_expand[i, j] = ~0
-    
-    return A_expand
+def np_fill_bitmatrix(A, dtype=None):
+    dtype = np.dtype(A.dtype if dtype is None else dtype)
+    return np.where(A != 0, ~dtype.type(0), dtype.type(0))
+
+def as_mask_words(A, dtype):
+    """
+    0 / ~0 mask matrix A as dtype masks, A itself when it already has that
+    dtype, so kernel entry points do not copy the encoder on every call
+    """
+    if A.dtype == np.dtype(dtype):
+        return A
+    return np_fill_bitmatrix(A, dtype)
+
+def as_words(arr, dtype):
+    """
+    Reinterpret the bytes of a packet matrix as dtype words, N // itemsize per row
+    """
+    if arr.dtype == np.dtype(dtype):
+        return arr
+    return arr.view(dtype)
+
+def load_bitmatrix(path):
+    """
+    Read a 0/1 bitmatrix stored as space separated rows (xorslp_enc_matrix format)
+    """
+    with open(path) as f:
+        A = [[int(x) for x in line.split()] for line in f.read().splitlines() if line.strip()]
+    return np.array(A).astype(np.uint8)
+
+def np_invert_bitmatrix(A):
+    """
+    Invert a square bitmatrix over GF(2), 1s may be stored as any nonzero value
+    """
+    n = A.shape[0]
+    aug = np.concatenate((A != 0, np.eye(n, dtype=bool)), axis=1)
+    for col in range(n):
+        pivots = np.nonzero(aug[col:, col])[0]
+        if pivots.size == 0:
+            raise ValueError("bitmatrix is singular")
+        pivot = col + pivots[0]
+        if pivot != col:
+            aug[[col, pivot]] = aug[[pivot, col]]
+        rows = aug[:, col].copy()
+        rows[col] = False
+        aug[rows] ^= aug[col]
+    return aug[:, n:].astype(np.uint8)
 
 def np_bitmatrix(M, N, K, A, B):
-    A = np_expand_bitmatrix(A)
-    out = np.zeros([M, N], dtype=np.uint8)
-    for i in range(M):
-        for j in range(N):
-            for k in range(K):
-                out[i, j] = np.bitwise_xor(np.bitwise_and(A[i, k], B[k, j]), out[i, j])
+    """
+    Reference bitmatrix multiply of B by the expansion of A
+    """
+    A = np_expand_bitmatrix(A, B.dtype)
+    assert A.shape == (M, K) and B.shape == (K, N)
+    return np_bitmatrix_multiply(A, B)
+
+def np_bitmatrix_multiply(A, B):
+    """
+    out[i] = XOR_k (A[i, k] & B[k]) for an expanded (mask) bitmatrix A,
+    vectorized over the rows of the output
+    """
+    out = np.zeros([A.shape[0], B.shape[1]], dtype=B.dtype)
+    tmp = np.empty_like(out)
+    for k in range(A.shape[1]):
+        np.bitwise_and(A[:, k, np.newaxis], B[k], out=tmp)
+        out ^= tmp
     return out
 
 
+def np_xor_fold(B, L):
+    """
+    XOR-fold every row of B into L lanes: out[k, l] = XOR_r B[k, r * L + l]
+    """
+    return np.bitwise_xor.reduce(B.reshape(B.shape[0], -1, L), axis=1)
+
+def np_fragment_checksums(row_sums, ecW):
+    """
+    Combine the folded checksums of the ecW packets of each fragment
+    """
+    return np.bitwise_xor.reduce(row_sums.reshape(-1, ecW, row_sums.shape[1]), axis=1)
+
+
 def np_bitmatrix_popcount(M, N, K, A, B):
     out = np.zeros([M, N], dtype=np.uint8)
     for i in range(M):
@@ -68,6 +204,119 @@ def np_bitmatrix_popcount(M, N, K, A, B):
             out[i, j] = np.bitwise_and(out[i, j].bit_count(), 0b1)
     return out
 
+def aligned_empty(shape, dtype="uint8", alignment=TVM_ALIGNMENT):
+    """
+    np.empty whose data pointer is aligned for zero-copy use by TVM kernels
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -raw.ctypes.data % alignment
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+def is_zero_copy(arr, alignment=TVM_ALIGNMENT):
+    """
+    Whether a NumPy array can be handed to a TVM kernel through DLPack
+    """
+    return (arr.flags.c_contiguous and arr.flags.writeable
+            and arr.ctypes.data % alignment == 0)
+
+def as_tvm_array(arr, dev):
+    """
+    Zero-copy DLPack view of arr when possible, a copy otherwise
+    """
+    if is_zero_copy(arr):
+        return tvm.nd.from_dlpack(arr)
+    return tvm.nd.array(arr, device=dev)
+
+def get_llc_size(default=64 * 1024**2):
+    """
+    Size in bytes of the largest CPU cache, read from sysfs
+    """
+    sizes = []
+    for path in Path('/sys/devices/system/cpu/cpu0/cache').glob('index*/size'):
+        size = path.read_text().strip()
+        unit = {'K': 1024, 'M': 1024**2, 'G': 1024**3}.get(size[-1], 1)
+        sizes.append(int(size.rstrip('KMG')) * unit)
+    return max(sizes, default=default)
+
+# TVM thread pool affinity modes, see threading::ThreadGroup::AffinityMode
+AFFINITY_MODES = {'big': 1, 'little': -1, 'pin': -2, 'share': -3}
+
+def parse_cpulist(text):
+    """
+    Parse a sysfs cpu list such as "0-3,8-11"
+    """
+    cpus = []
+    for part in text.strip().split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+def get_numa_nodes():
+    """
+    Online NUMA nodes, [None] if the machine does not expose any
+    """
+    path = Path('/sys/devices/system/node/online')
+    if not path.exists():
+        return [None]
+    return parse_cpulist(path.read_text()) or [None]
+
+def get_physical_cpus(numa_node=None):
+    """
+    One logical cpu per physical core, of one NUMA node or of the machine,
+    restricted to the cpus this process may run on
+    """
+    if numa_node is None:
+        cpus = sorted(psutil.Process().cpu_affinity())
+    else:
+        path = Path('/sys/devices/system/node/node' + str(numa_node) + '/cpulist')
+        cpus = [c for c in parse_cpulist(path.read_text())
+                if c in psutil.Process().cpu_affinity()]
+    physical = []
+    seen = set()
+    for c in cpus:
+        path = Path('/sys/devices/system/cpu/cpu' + str(c) + '/topology/thread_siblings_list')
+        siblings = tuple(parse_cpulist(path.read_text())) if path.exists() else (c,)
+        if siblings not in seen:
+            seen.add(siblings)
+            physical.append(c)
+    return physical
+
+def config_runtime(num_threads=0, affinity='big', numa_node=None, cpus=None):
+    """
+    Configure the TVM thread pool for EC kernels
+
+    num_threads workers (0 for all) run on `cpus`, or on the physical cores
+    of `numa_node`; "pin" and "share" default to the physical cores of the
+    machine, as TVM would otherwise share every cpu. With a cpu set, the process is restricted to it as well,
+    so buffers it allocates are first touched on that node, and the "big" /
+    "little" modes become "share". Returns the cpus used, if any.
+    """
+    if cpus is None and (numa_node is not None or affinity in ('pin', 'share')):
+        cpus = get_physical_cpus(numa_node)
+    config_threadpool = tvm.get_global_func('runtime.config_threadpool')
+    if cpus is None:
+        config_threadpool(AFFINITY_MODES[affinity], num_threads)
+        return None
+    cpus = list(cpus)
+    if num_threads:
+        cpus = cpus[:num_threads]
+    if affinity not in ('pin', 'share'):
+        affinity = 'share'
+    psutil.Process().cpu_affinity(cpus)
+    config_threadpool(AFFINITY_MODES[affinity], len(cpus), [str(c) for c in cpus])
+    return cpus
+
+def pin_threads(cpus):
+    """
+    Pin the process and one TVM worker thread per core to the given cpus
+    """
+    config_runtime(affinity='pin', cpus=cpus)
+
 def export_lib(func, lib_name):
     output_file = Path(lib_name)
     output_file.parent.mkdir(exist_ok=True, parents=True)
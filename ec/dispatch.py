@@ -0,0 +1,228 @@
+"""
+Shape-generic bitmatrix encoding
+
+Tuned schedules are specialized to one packet size N. BitmatrixDispatcher
+compiles the tuned kernels of a few N buckets with strided input and output
+buffers, so each one can run in place on a column block of a wider (K, L)
+data matrix, covers L greedily with the largest buckets that fit and hands
+the remaining columns to a symbolic-N kernel.
+"""
+
+import argparse
+import time
+import numpy as np
+import tvm
+from tvm import te
+from bitmatrix_autoschedule import bitmatrix, xor
+from common import get_tvm_target_string, aligned_empty, as_words, as_mask_words, as_tvm_array
+from common import np_expand_bitmatrix, np_bitmatrix_multiply
+from common import TVM_ALIGNMENT
+from kernel_cache import get_kernel, log_file_stamp
+from benchmark import log_prefix
+
+
+def strided_binds(args):
+    """
+    Bind B and the output to buffers with a runtime row stride
+    """
+    binds = {}
+    for t in args[1:]:
+        binds[t] = tvm.tir.decl_buffer(
+            t.shape, t.dtype, name=t.op.name,
+            strides=[te.var(t.op.name + "_stride"), 1])
+    return binds
+
+
+def get_best_strided_as_func(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    dtype = argv.get('dtype', 'uint8')
+    N = argv['N'] // np.dtype(dtype).itemsize
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    task = tvm.auto_scheduler.SearchTask(
+        func=bitmatrix, args=(
+            M, N, K, dtype), target=target)
+
+    sch, args = task.apply_best(argv['log_file'])
+
+    func = tvm.build(sch, args, target, binds=strided_binds(args))
+    return func
+
+
+def get_remainder_func(ecParity, ecData, ecW, dtype="uint8", tile=64):
+    """
+    bitmatrix kernel over a symbolic number of columns: column tiles of
+    `tile` words run in parallel, each tile is vectorized
+    """
+    target = get_tvm_target_string()
+    M = ecParity * ecW
+    K = ecData * ecW
+
+    def build():
+        n = te.var("n")
+        A = te.placeholder((M, K), name="A", dtype=dtype)
+        B = te.placeholder((K, n), name="B", dtype=dtype)
+        k = te.reduce_axis((0, K), name="k")
+        bitmul = te.compute(
+            (M, n),
+            lambda i, j: xor(A[i, k] & B[k, j], axis=k),
+            name="bitmul",
+        )
+
+        s = te.create_schedule(bitmul.op)
+        i, j = s[bitmul].op.axis
+        jo, ji = s[bitmul].split(j, factor=tile)
+        s[bitmul].reorder(jo, i, k, ji)
+        s[bitmul].parallel(jo)
+        s[bitmul].vectorize(ji)
+        args = [A, B, bitmul]
+        return tvm.build(s, args, target, binds=strided_binds(args))
+
+    return get_kernel('bitmatrix_remainder', (M, K, dtype, tile, target), build)
+
+
+def strided_view(arr):
+    """
+    Zero-copy view of a (possibly column sliced) matrix for the strided kernels
+    """
+    assert arr.strides[-1] == arr.itemsize and arr.ctypes.data % TVM_ALIGNMENT == 0
+    return tvm.nd.from_dlpack(arr)
+
+
+class BitmatrixDispatcher:
+    """
+    Encode (K, L) data for any L with the tuned kernels of the given buckets
+
+    buckets maps a packet size N (bytes, multiple of TVM_ALIGNMENT) to the
+    tuning log holding its schedule.
+    """
+    def __init__(self, argv, buckets, tile=64):
+        self.argv = argv
+        self.dtype = argv.get('dtype', 'uint8')
+        self.itemsize = np.dtype(self.dtype).itemsize
+        self.kernels = []
+        for N, log_file in sorted(buckets.items(), reverse=True):
+            assert N % TVM_ALIGNMENT == 0
+            a = dict(argv, N=N, log_file=log_file)
+            key = (a['ecParity'], a['ecData'], a['ecW'], N, self.dtype,
+                   get_tvm_target_string(), log_file_stamp(log_file))
+            func = get_kernel('bitmatrix_strided', key,
+                              lambda a=a: get_best_strided_as_func(a), argv.get('cache_dir'))
+            self.kernels.append((N, func))
+        self.remainder = get_remainder_func(argv['ecParity'], argv['ecData'], argv['ecW'],
+                                            self.dtype, tile)
+        # (key, masks, device array) of the last encoder
+        self.encoder = None
+
+    def encoder_array(self, encoder):
+        """
+        Device array of the encoder masks in the kernel word type, reused
+        while the same encoder is passed
+        """
+        key = (encoder.shape, encoder.dtype.str, encoder.tobytes())
+        if self.encoder is None or self.encoder[0] != key:
+            masks = as_mask_words(encoder, self.dtype)
+            self.encoder = (key, masks, as_tvm_array(masks, tvm.cpu()))
+        return self.encoder[2]
+
+    def plan(self, L):
+        """
+        Split L bytes of columns into (offset, width, kernel) pieces
+        """
+        pieces = []
+        offset = 0
+        for N, func in self.kernels:
+            while L - offset >= N:
+                pieces.append((offset, N, func))
+                offset += N
+        if offset < L:
+            pieces.append((offset, L - offset, self.remainder))
+        return pieces
+
+    def __call__(self, encoder, data, out=None):
+        argv = self.argv
+        M = argv['ecParity'] * argv['ecW']
+        K = argv['ecData'] * argv['ecW']
+        L = data.shape[1]
+        assert encoder.shape == (M, K)
+        assert data.shape == (K, L) and L % self.itemsize == 0
+        if data.ctypes.data % TVM_ALIGNMENT != 0 or data.strides[-1] != data.itemsize:
+            aligned = aligned_empty(data.shape)
+            aligned[...] = data
+            data = aligned
+        if out is None:
+            out = aligned_empty((M, L))
+        assert out.shape == (M, L)
+
+        a_tvm = self.encoder_array(encoder)
+        data = as_words(data, self.dtype)
+        out_words = as_words(out, self.dtype)
+        for offset, width, func in self.plan(L):
+            cols = slice(offset // self.itemsize, (offset + width) // self.itemsize)
+            func(a_tvm, strided_view(data[:, cols]), strided_view(out_words[:, cols]))
+        return out
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, default=4)
+    parser.add_argument('-ecData', '-D', type=int, default=10)
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8')
+    parser.add_argument('--log_dir', default='log/default/',
+                        help='Directory holding the [<dtype>_]P_<P>_n_<N>_D_<D>.json tuning logs')
+    parser.add_argument('--buckets', nargs='+', type=int, default=[128000, ],
+                        help='Packet sizes N with tuned logs in log_dir')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000000, ],
+                        help='Packet sizes L to encode')
+    parser.add_argument('--tile', type=int, default=64,
+                        help='Vector tile of the remainder kernel, in words')
+    parser.add_argument('--number', type=int, default=100)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    a = {
+        'ecParity': argv.ecParity,
+        'ecData': argv.ecData,
+        'ecW': argv.ecW,
+        'dtype': argv.dtype,
+    }
+    buckets = {
+        N: argv.log_dir + log_prefix('b', 1, argv.dtype) + 'P_' + str(argv.ecParity) + '_n_' + str(N) + '_D_' + str(argv.ecData) + '.json'
+        for N in argv.buckets
+    }
+    dispatcher = BitmatrixDispatcher(a, buckets, argv.tile)
+
+    M = argv.ecParity * argv.ecW
+    K = argv.ecData * argv.ecW
+    encoder = np_expand_bitmatrix(np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(M, argv.ecData)).astype(np.uint8))
+
+    for L in argv.sizes:
+        data = aligned_empty((K, L))
+        data[...] = np.random.randint(np.iinfo(np.uint8).max, size=(K, L))
+        out = dispatcher(encoder, data)
+
+        # Check results
+        np.testing.assert_equal(np_bitmatrix_multiply(encoder, data), out)
+
+        tic = time.perf_counter()
+        for _ in range(argv.number):
+            dispatcher(encoder, data, out)
+        ex_time = (time.perf_counter() - tic) / argv.number
+        widths = [width for _, width, _ in dispatcher.plan(L)]
+        print("L=%d: pieces %s, %.6f s, %.3f MB/s"
+              % (L, widths, ex_time, data.size / (1024**2) / ex_time))
+
+
+if __name__ == '__main__':
+    main()
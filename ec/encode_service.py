@@ -0,0 +1,243 @@
+"""
+Asynchronous encode / decode service with request coalescing
+
+Coroutines submit stripes to EncodeService and await the result. A single
+dispatcher task drains the request queue: every request waiting when it
+wakes up (up to max_batch) is handled in one round on a dedicated kernel
+thread, so the event loop keeps serving I/O while kernels run and requests
+arriving meanwhile pile up for the next round. Only encodes are coalesced
+into batched kernel calls: the encode requests of a round are stacked and go
+through the batched kernel when a batch log is given (one launch per `batch`
+stripes). Decode requests are grouped by erasure pattern, sharing one
+decoder bitmatrix, but each still runs its own decode kernel call. A failing
+request only fails its own future. The service keeps queue depth, batch size
+and latency metrics.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bitmatrix_autoschedule import bitmatrix_multiply, bitmatrix_multiply_batch
+from common import aligned_empty
+from rs import ReedSolomon, add_common_args as rs_add_common_args
+
+
+class EncodeService:
+    def __init__(self, rs, batch=1, batch_log_file=None, max_batch=64, max_delay=0.0,
+                 history=10000):
+        """
+        rs is the ReedSolomon codec to run. With batch_log_file, encode
+        rounds use the batched kernel tuned for `batch` stripes. max_delay (s)
+        is how long the dispatcher waits for more requests after the first.
+        """
+        self.rs = rs
+        self.batch_args = dict(rs.args, batch=batch, log_file=batch_log_file) if batch_log_file else None
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = None
+        self.dispatcher = None
+        self.executor = None
+        self.latencies = deque(maxlen=history)
+        self.counters = {'requests': 0, 'rounds': 0, 'kernel_calls': 0, 'max_queue_depth': 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        # one thread, kernels already use all the TVM worker threads
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ec-kernel')
+        self.dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        return self
+
+    async def close(self):
+        await self.queue.join()
+        self.dispatcher.cancel()
+        try:
+            await self.dispatcher
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _submit(self, kind, key, payload):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((kind, key, payload, future, time.perf_counter()))
+        self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self.queue.qsize())
+        return future
+
+    async def encode(self, data):
+        """
+        Parity of one (K, N) data stripe, as an (M, N) array
+        """
+        return await self._submit('encode', None, data)
+
+    async def decode(self, remain, drop):
+        """
+        (K, N) data recovered from the surviving fragments, see ReedSolomon.decode
+        """
+        return await self._submit('decode', tuple(sorted(set(drop))), remain)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            if self.max_delay:
+                await asyncio.sleep(self.max_delay)
+            while len(requests) < self.max_batch and not self.queue.empty():
+                requests.append(self.queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(self.executor, self._run, requests)
+            except Exception as e:
+                results = [e] * len(requests)
+            done = time.perf_counter()
+            for (_, _, _, future, queued), result in zip(requests, results):
+                if not future.cancelled():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                self.latencies.append(done - queued)
+                self.queue.task_done()
+            self.counters['requests'] += len(requests)
+            self.counters['rounds'] += 1
+
+    def _run(self, requests):
+        """
+        Run one round of requests on the kernel thread, returns their results
+        """
+        results = [None] * len(requests)
+        groups = {}
+        for i, (kind, key, _, _, _) in enumerate(requests):
+            groups.setdefault((kind, key), []).append(i)
+
+        for (kind, key), indices in groups.items():
+            if kind == 'encode':
+                try:
+                    outs = self._encode([requests[i][2] for i in indices])
+                except Exception as e:
+                    outs = [e] * len(indices)
+            else:
+                outs = []
+                for i in indices:
+                    try:
+                        outs.append(self.rs.decode(requests[i][2], key))
+                    except Exception as e:
+                        outs.append(e)
+                    self.counters['kernel_calls'] += 1
+            for i, out in zip(indices, outs):
+                results[i] = out
+        return results
+
+    def _encode(self, stripes):
+        rs = self.rs
+        if self.batch_args and len(stripes) > 1:
+            parity = bitmatrix_multiply_batch(self.batch_args, rs.encoder, stripes)
+            self.counters['kernel_calls'] += -(-len(stripes) // self.batch_args['batch'])
+            return list(parity)
+        outs = []
+        for data in stripes:
+            out = aligned_empty((rs.argv.ecParity * rs.argv.ecW, rs.argv.N))
+            outs.append(bitmatrix_multiply(rs.args, rs.encoder, data, out))
+            self.counters['kernel_calls'] += 1
+        return outs
+
+    def metrics(self):
+        """
+        Current queue depth, request / round / kernel call counts, mean batch
+        size and latency percentiles (s) over the recent requests
+        """
+        m = dict(self.counters, queue_depth=self.queue.qsize() if self.queue else 0)
+        m['mean_batch'] = m['requests'] / m['rounds'] if m['rounds'] else 0.0
+        if self.latencies:
+            latencies = np.array(self.latencies)
+            m['latency_mean(s)'] = float(latencies.mean())
+            for q in (50, 95, 99):
+                m['latency_p' + str(q) + '(s)'] = float(np.percentile(latencies, q))
+        return m
+
+
+async def run_clients(service, stripes, clients, requests):
+    """
+    `clients` coroutines encoding `requests` stripes each, one at a time;
+    returns the elapsed time
+    """
+    async def client(c):
+        for r in range(requests):
+            await service.encode(stripes[(c * requests + r) % len(stripes)])
+
+    tic = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    return time.perf_counter() - tic
+
+
+async def run_service(rs, stripes, argv):
+    service = EncodeService(rs, argv.batch, argv.read_batch_log_file, argv.max_batch, argv.max_delay)
+    async with service:
+        elapsed = await run_clients(service, stripes, argv.clients, argv.requests)
+        return elapsed, service.metrics()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    rs_add_common_args(parser)
+    parser.add_argument('--read_batch_log_file', '-bl', default=None,
+                        help='Batched kernel schedule to encode coalesced requests with, one call per stripe if not set')
+    parser.add_argument('-batch', type=int, default=8,
+                        help='Number of stripes per call of the batched kernel')
+    parser.add_argument('--clients', type=int, default=64,
+                        help='Number of concurrent client coroutines')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='Number of encode requests per client')
+    parser.add_argument('--max_batch', type=int, default=64,
+                        help='Most requests handled per dispatcher round')
+    parser.add_argument('--max_delay', type=float, default=0.0,
+                        help='Seconds the dispatcher waits for more requests after the first')
+    parser.add_argument('--result_file', default='encode_service.json')
+    argv = parser.parse_args()
+
+    rs = ReedSolomon(argv)
+    K = argv.ecData * argv.ecW
+    stripes = []
+    for _ in range(16):
+        data = aligned_empty((K, argv.N))
+        data[...] = np.random.randint(np.iinfo(np.uint8).max, size=(K, argv.N))
+        stripes.append(data)
+
+    # baseline: the same requests as blocking calls, one kernel each
+    total = argv.clients * argv.requests
+    out = aligned_empty((argv.ecParity * argv.ecW, argv.N))
+    tic = time.perf_counter()
+    for i in range(total):
+        bitmatrix_multiply(rs.args, rs.encoder, stripes[i % len(stripes)], out)
+    blocking = time.perf_counter() - tic
+
+    elapsed, metrics = asyncio.run(run_service(rs, stripes, argv))
+    nbytes = total * K * argv.N / (1024**2)
+    result = dict(metrics, **{
+        'ecParity': argv.ecParity,
+        'N': argv.N,
+        'ecData': argv.ecData,
+        'ecW': argv.ecW,
+        'clients': argv.clients,
+        'batch': argv.batch if argv.read_batch_log_file else 1,
+        'blocking_bandwidth(MB/s)': nbytes / blocking,
+        'service_bandwidth(MB/s)': nbytes / elapsed,
+    })
+    print("blocking: %.3f MB/s, service: %.3f MB/s, mean batch %.1f, p99 latency %.6f s"
+          % (result['blocking_bandwidth(MB/s)'], result['service_bandwidth(MB/s)'],
+             result['mean_batch'], result.get('latency_p99(s)', 0.0)))
+
+    with open(argv.result_file, 'w', encoding='utf-8') as f:
+        json.dump([result], f, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
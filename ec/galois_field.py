@@ -0,0 +1,162 @@
+"""
+GF(2^w) arithmetic and the low-density Cauchy encoder search
+
+Every square submatrix of a Cauchy matrix C[i, j] = 1 / (X[i] + Y[j]) over
+GF(2^w) is nonsingular, and stays so when rows or columns are scaled, so all
+these variants are MDS encoders. Their expanded bitmatrices differ in the
+number of ones, i.e. in the XORs a sparsity-aware kernel (bitmatrix_const)
+has to do. The search tries random X / Y element choices, scales every
+column so one parity row is all ones (identity blocks), then scales each
+other row by the element leaving it with the fewest ones, as in Jerasure's
+cauchy_good, and finally swaps single X / Y elements while that still lowers
+the density. Winners are cached in the kernel cache directory.
+
+No kernel code is imported here, so codecs can use it at import time.
+"""
+
+from pathlib import Path
+import numpy as np
+from common import load_bitmatrix
+from kernel_cache import get_cache_dir
+
+# primitive polynomials of GF(2^w)
+PRIMITIVE_POLYS = {4: 0x13, 8: 0x11d, 16: 0x1100b}
+
+
+def gf_tables(w):
+    """
+    exp / log tables of GF(2^w), exp having twice the group order entries
+    """
+    poly = PRIMITIVE_POLYS[w]
+    order = (1 << w) - 1
+    exp = np.zeros(2 * order, dtype=np.int64)
+    log = np.zeros(order + 1, dtype=np.int64)
+    x = 1
+    for i in range(order):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x >> w:
+            x ^= poly
+    exp[order:] = exp[:order]
+    return exp, log
+
+
+class GF:
+    def __init__(self, w):
+        self.w = w
+        self.order = (1 << w) - 1
+        self.exp, self.log = gf_tables(w)
+        self.ones_table = np.array([self.element_bitmatrix(e).sum() for e in range(1 << w)])
+
+    def mul(self, a, b):
+        if a == 0 or b == 0:
+            return 0
+        return int(self.exp[self.log[a] + self.log[b]])
+
+    def div(self, a, b):
+        """
+        Element-wise a / b for nonzero arrays (or scalars) of elements
+        """
+        return self.exp[(self.log[a] - self.log[b]) % self.order]
+
+    def element_bitmatrix(self, e):
+        """
+        (w, w) GF(2) matrix of the multiplication by e: column c holds the
+        bits of e * 2^c, least significant bit in row 0
+        """
+        w = self.w
+        out = np.zeros((w, w), dtype=np.uint8)
+        x = int(e)
+        for c in range(w):
+            out[:, c] = (x >> np.arange(w)) & 1
+            x = self.mul(x, 2)
+        return out
+
+
+def expand(gf, C):
+    """
+    Expand a (P, D) matrix over GF(2^w) into its (P * w, D * w) bitmatrix
+    """
+    return np.block([[gf.element_bitmatrix(e) for e in row] for row in C])
+
+
+def cauchy_matrix(gf, X, Y):
+    X = np.asarray(X)[:, np.newaxis]
+    Y = np.asarray(Y)[np.newaxis, :]
+    return gf.div(1, X ^ Y)
+
+
+def improve(gf, C):
+    """
+    Scale the columns so one row is all ones, then every other row by the
+    element minimizing its number of ones. Returns (ones, C) for the best
+    choice of the all-ones row.
+    """
+    best = None
+    for r in range(C.shape[0]):
+        S = gf.div(C, C[r])
+        for i in range(S.shape[0]):
+            if i == r:
+                continue
+            # candidate scalings of row i: divide it by each of its elements
+            rows = gf.div(S[i][np.newaxis, :], S[i][:, np.newaxis])
+            S[i] = rows[np.argmin(gf.ones_table[rows].sum(axis=1))]
+        ones = int(gf.ones_table[S].sum())
+        if best is None or ones < best[0]:
+            best = (ones, S)
+    return best
+
+
+def search_cauchy(ecParity, ecData, ecW=8, trials=200, seed=0):
+    """
+    Lowest density Cauchy bitmatrix found from `trials` random element
+    choices (plus X = 0..P-1, Y = P..P+D-1), each improved by scaling and
+    then by swapping single elements of X / Y for unused ones while that
+    lowers the density; returns (bitmatrix, C)
+    """
+    gf = GF(ecW)
+    n = ecParity + ecData
+    assert n <= 1 << ecW
+    rng = np.random.default_rng(seed)
+    candidates = [np.arange(n)]
+    for _ in range(trials):
+        candidates.append(rng.permutation(1 << ecW)[:n])
+
+    def score(elements):
+        return improve(gf, cauchy_matrix(gf, elements[:ecParity], elements[ecParity:]))
+
+    best = min(((score(e), e) for e in candidates), key=lambda c: c[0][0])
+    (ones, C), elements = best
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n):
+            for e in np.setdiff1d(np.arange(1 << ecW), elements):
+                trial = elements.copy()
+                trial[i] = e
+                t_ones, t_C = score(trial)
+                if t_ones < ones:
+                    ones, C, elements = t_ones, t_C, trial
+                    improved = True
+    return expand(gf, C), C
+
+
+def cauchy_path(ecParity, ecData, ecW, trials, seed, cache_dir=None):
+    return Path(cache_dir or get_cache_dir()) / 'bitmatrix' / (
+        'cauchy_' + str(ecData) + '_' + str(ecParity) + '_w' + str(ecW)
+        + '_t' + str(trials) + '_s' + str(seed) + '.txt')
+
+
+def get_cauchy_bitmatrix(ecParity, ecData, ecW=8, trials=200, seed=0, cache_dir=None):
+    """
+    search_cauchy result, stored in the xorslp_enc_matrix format in the
+    cache directory and loaded from there afterwards
+    """
+    path = cauchy_path(ecParity, ecData, ecW, trials, seed, cache_dir)
+    if path.exists():
+        return load_bitmatrix(path)
+    bitmatrix, _ = search_cauchy(ecParity, ecData, ecW, trials, seed)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    np.savetxt(path, bitmatrix, fmt='%d')
+    return bitmatrix
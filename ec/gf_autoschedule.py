@@ -0,0 +1,282 @@
+"""
+Reed-Solomon encoding directly in GF(2^8) with split nibble tables
+
+Instead of expanding every coefficient into an ecW x ecW bitmatrix (K grows
+by ecW), each parity byte is out[i, j] = XOR_k c[i, k] * B[k, j] over
+GF(2^8), and every product is looked up ISA-L style: c * b = lo[b & 15] ^
+hi[b >> 4], lo / hi being the 16-entry products of c with the low and high
+nibbles. The (P, D, 32) table tensor replaces the encoder, fragments are
+plain (D, ecW * N) byte rows, so a stripe holds as many bytes as the one of
+the bitmatrix kernel with the same P, D, N and ecW and the bandwidths compare
+directly.
+"""
+
+import argparse
+from collections import OrderedDict
+import numpy as np
+import tvm
+from tvm import te, auto_scheduler
+from bitmatrix_autoschedule import xor, _run_into
+from galois_field import GF
+from common import get_tvm_target_string, export_lib, aligned_empty, as_tvm_array
+from kernel_cache import get_kernel, log_file_stamp
+from warm_start import warm_start_policy
+
+GF8 = GF(8)
+# nibble tables of the coefficient matrices gf_multiply was called with,
+# least recently used first
+_tables = OrderedDict()
+
+
+@auto_scheduler.register_workload
+def gf_table(P, N, D):
+    T = te.placeholder((P, D, 32), name="T", dtype="uint8")
+    B = te.placeholder((D, N), name="B", dtype="uint8")
+
+    k = te.reduce_axis((0, D), name="k")
+    gfmul = te.compute(
+        (P, N),
+        lambda i, j: xor(
+            T[i, k, (B[k, j] & 15).astype("int32")]
+            ^ T[i, k, 16 + (B[k, j] >> 4).astype("int32")], axis=k),
+        name="gfmul",
+    )
+
+    return [T, B, gfmul]
+
+
+def np_gf_mul(gf, a, b):
+    """
+    Element-wise product over GF(2^w) of integer arrays
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    out = gf.exp[gf.log[a] + gf.log[b]]
+    return np.where((a == 0) | (b == 0), 0, out).astype(np.uint8)
+
+
+def np_nibble_tables(gf, C):
+    """
+    (P, D, 32) lookup tables of a (P, D) coefficient matrix: entries 0..15
+    are the products with the low nibbles, 16..31 with the high ones
+    """
+    nibbles = np.arange(16)
+    lo = np_gf_mul(gf, C[:, :, np.newaxis], nibbles)
+    hi = np_gf_mul(gf, C[:, :, np.newaxis], nibbles << 4)
+    return np.concatenate((lo, hi), axis=2)
+
+
+def np_gf_multiply(gf, C, B):
+    """
+    Reference out[i] = XOR_k C[i, k] * B[k] over GF(2^8)
+    """
+    out = np.zeros((C.shape[0], B.shape[1]), dtype=np.uint8)
+    for i in range(C.shape[0]):
+        for k in range(C.shape[1]):
+            out[i] ^= np_gf_mul(gf, C[i, k], B[k])
+    return out
+
+
+def get_gf_search_task(argv):
+    assert argv['ecW'] == 8, "nibble tables are for GF(2^8)"
+    return tvm.auto_scheduler.SearchTask(
+        func=gf_table, args=(
+            argv['ecParity'], argv['ecW'] * argv['N'], argv['ecData']),
+        target=get_tvm_target_string())
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, default=4)
+    parser.add_argument('-N', type=int, default=128)
+    parser.add_argument('-ecData', '-D', type=int, default=8)
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--log_dir', default='log/gf_table.json',
+                        help='Directory to save log to')
+    parser.add_argument('--tune_num_trials_total', type=int, default=10)
+    parser.add_argument('--bandwidth_size', default='h')
+
+
+def benchmark_gf(argv):
+    target = get_tvm_target_string()
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    # same bytes per fragment as the ecW packets of the bitmatrix kernel
+    N = argv['ecW'] * argv['N']
+
+    task = get_gf_search_task(argv)
+
+    log_file = argv['log_file']
+    tune_option = auto_scheduler.TuningOptions(
+        num_measure_trials=argv['tune_num_trials_total'],
+        measure_callbacks=[auto_scheduler.RecordToFile(log_file)],
+        verbose=0,
+    )
+
+    if argv.get('tune', True):
+        search_policy = None
+        if argv.get('warm_start_logs'):
+            search_policy = warm_start_policy(task, argv['warm_start_logs'], log_file + '.seed')
+        task.tune(tune_option, search_policy)
+    sch, args = task.apply_best(log_file)
+
+    func = tvm.build(sch, args, target)
+    gf = GF8
+    c_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(ecParity, ecData)).astype(np.uint8)
+    t_np = np_nibble_tables(gf, c_np)
+    b_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(ecData, N), dtype=np.uint8)
+    out_np = np_gf_multiply(gf, c_np, b_np)
+
+    if argv["export"]:
+        export_lib(func, argv["export"])
+
+    dev = tvm.cpu()
+    t_tvm = tvm.nd.array(t_np, device=dev)
+    b_tvm = tvm.nd.array(b_np, device=dev)
+    out_tvm = tvm.nd.empty(out_np.shape, device=dev, dtype="uint8")
+    func(t_tvm, b_tvm, out_tvm)
+
+    # Check results
+    np.testing.assert_equal(out_np, out_tvm.numpy())
+
+    evaluator = func.time_evaluator(
+        func.entry_name, dev, number=1000, repeat=10)
+    ex_time = evaluator(t_tvm, b_tvm, out_tvm).results
+
+    ex_time = np.array(ex_time)
+
+    if argv['bandwidth_size'] == 'f':
+        bandwidth = (t_np.size + b_np.size + out_np.size) / (1024**2) / ex_time
+    else:
+        bandwidth = (b_np.size) / (1024**2) / ex_time
+
+    del task
+
+    return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
+
+
+def get_best_gf_as_func(argv):
+    task = get_gf_search_task(argv)
+
+    if argv.get('verbose', 0) >= 1:
+        print("Computational DAG:")
+        print(task.compute_dag)
+
+    sch, args = task.apply_best(argv['log_file'])
+
+    if argv.get('verbose', 0) >= 1:
+        print("Lowered TIR:")
+        print(tvm.lower(sch, args, simple_mode=True))
+
+    func = tvm.build(sch, args, get_tvm_target_string())
+    return func
+
+
+def get_cached_gf_func(argv):
+    target = get_tvm_target_string()
+    key = (argv['ecParity'], argv['ecData'], argv['ecW'], argv['N'], target,
+           log_file_stamp(argv['log_file']))
+    return get_kernel('gf_table', key, lambda: get_best_gf_as_func(argv),
+                      argv.get('cache_dir'))
+
+
+def get_best_gf_benchmark(argv):
+    func = get_best_gf_as_func(argv)
+
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    N = argv['ecW'] * argv['N']
+
+    gf = GF8
+    c_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(ecParity, ecData)).astype(np.uint8)
+    b_np = np.random.randint(
+        np.iinfo(np.uint8).max,
+        size=(ecData, N), dtype=np.uint8)
+
+    dev = tvm.cpu()
+    t_tvm = tvm.nd.array(np_nibble_tables(gf, c_np), device=dev)
+    b_tvm = tvm.nd.array(b_np, device=dev)
+    out_tvm = tvm.nd.empty((ecParity, N), device=dev, dtype="uint8")
+    func(t_tvm, b_tvm, out_tvm)
+
+    np.testing.assert_equal(np_gf_multiply(gf, c_np, b_np), out_tvm.numpy())
+
+    evaluator = func.time_evaluator(
+        func.entry_name, dev, number=1000, repeat=10)
+    ex_time = np.array(evaluator(t_tvm, b_tvm, out_tvm).results)
+    bandwidth = b_np.size / (1024**2) / ex_time
+
+    return (np.mean(ex_time), np.mean(bandwidth), np.std(bandwidth))
+
+
+def get_nibble_tables(coefficients, cache_size=64):
+    """
+    np_nibble_tables of a coefficient matrix, kept aligned so the kernel
+    reads them without a copy, memoized for the last cache_size matrices
+    """
+    key = (coefficients.shape, coefficients.tobytes())
+    tables = _tables.get(key)
+    if tables is not None:
+        _tables.move_to_end(key)
+        return tables
+
+    tables = aligned_empty(coefficients.shape + (32,))
+    tables[...] = np_nibble_tables(GF8, coefficients)
+    _tables[key] = tables
+    while len(_tables) > cache_size:
+        _tables.popitem(last=False)
+    return tables
+
+
+def gf_multiply(argv, coefficients, data, out=None, tables=None):
+    """
+    Encode (D, ecW * N) data fragments with a (P, D) GF(2^8) coefficient
+    matrix, writing the (P, ecW * N) parity fragments into out. tables are
+    its precomputed np_nibble_tables, looked up in a cache of
+    argv['table_cache_size'] matrices if not given
+    """
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    N = argv['ecW'] * argv['N']
+    assert coefficients.shape == (ecParity, ecData)
+    assert data.shape == (ecData, N)
+    dev = tvm.cpu()
+    func = get_cached_gf_func(argv)
+    if out is None:
+        out = aligned_empty((ecParity, N))
+    assert out.shape == (ecParity, N)
+    if tables is None:
+        tables = get_nibble_tables(coefficients, argv.get('table_cache_size', 64))
+    t_tvm = as_tvm_array(tables, dev)
+
+    return _run_into(func, t_tvm, as_tvm_array(data, dev), out, dev)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    a = {
+        'ecParity': argv.ecParity,
+        'N': argv.N,
+        'ecData': argv.ecData,
+        'ecW': argv.ecW,
+        'log_file': argv.log_dir,
+        'tune_num_trials_total': argv.tune_num_trials_total,
+        'bandwidth_size': argv.bandwidth_size,
+        'export': None,
+    }
+    ex_time, bandwidth, std = benchmark_gf(a)
+    print("Execution time of this operator: %.6f s" % ex_time)
+    print("Bandwidth: %.3f MB/s (std %.3f)" % (bandwidth, std))
+
+
+if __name__ == '__main__':
+    main()
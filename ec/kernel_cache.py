@@ -0,0 +1,128 @@
+"""
+Compiled kernel cache
+
+Kernels are kept in an in-process LRU and exported as shared libraries to an
+on-disk cache directory, so a tuned schedule is only lowered and compiled once
+per (workload, shape, target, log file).
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+import tvm
+
+MAX_CACHED_KERNELS = int(os.environ.get('TVM_EC_KERNEL_CACHE_SIZE', 32))
+
+_kernels = OrderedDict()
+_lock = threading.Lock()
+
+# content of a tuning log at the time a kernel was built from it
+LogStamp = namedtuple('LogStamp', ['path', 'mtime_ns', 'size'])
+
+
+def get_cache_dir():
+    """
+    Directory holding the exported kernels, overridable by TVM_EC_CACHE_DIR
+    """
+    cache_dir = os.environ.get('TVM_EC_CACHE_DIR')
+    if cache_dir:
+        return Path(cache_dir)
+    return Path.home() / '.cache' / 'tvm-ec'
+
+
+def log_file_stamp(log_file):
+    """
+    Identify the content of a tuning log, so retuning invalidates cached kernels
+    """
+    if log_file is None or not os.path.exists(log_file):
+        return None
+    st = os.stat(log_file)
+    return LogStamp(os.path.abspath(log_file), st.st_mtime_ns, st.st_size)
+
+
+def _digest(key, length):
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:length]
+
+
+def _kernel_prefix(key):
+    """
+    File name prefix shared by the kernels of key built from any version of
+    its tuning logs
+    """
+    geometry = tuple(k.path if isinstance(k, LogStamp) else k for k in key)
+    return key[0] + '_' + _digest(geometry, 12) + '_'
+
+
+def _kernel_path(key, cache_dir):
+    return Path(cache_dir) / (_kernel_prefix(key) + _digest(key, 20) + '.so')
+
+
+def _remove_stale(key, path):
+    """
+    Delete the kernels of key built from older versions of its tuning logs
+    """
+    for stale in path.parent.glob(_kernel_prefix(key) + '?' * 20 + '.so'):
+        if stale != path:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+
+def get_kernel(name, key, build_fn, cache_dir=None):
+    """
+    Get the compiled kernel `name` for `key`, calling `build_fn` on a miss
+
+    The in-process LRU is checked first, then the on-disk cache. A freshly
+    built kernel is exported to disk, replacing the ones built from older
+    logs, before being returned; if the export fails it is only kept in
+    memory.
+    """
+    key = (name,) + tuple(key)
+    with _lock:
+        func = _kernels.get(key)
+        if func is not None:
+            _kernels.move_to_end(key)
+            return func
+
+    path = _kernel_path(key, cache_dir or get_cache_dir())
+    if path.exists():
+        func = tvm.runtime.load_module(str(path))
+    else:
+        func = build_fn()
+        # export under a private name first so concurrent processes never
+        # load a partially written library
+        tmp_path = path.with_name(path.stem + '.' + str(os.getpid()) + '.tmp.so')
+        try:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            func.export_library(str(tmp_path))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print("kernel_cache: cannot export %s to %s (%s), keeping it in memory only"
+                  % (name, path.parent, e))
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+        else:
+            _remove_stale(key, path)
+
+    with _lock:
+        _kernels[key] = func
+        _kernels.move_to_end(key)
+        while len(_kernels) > MAX_CACHED_KERNELS:
+            _kernels.popitem(last=False)
+    return func
+
+
+def clear_kernels(disk=False, cache_dir=None):
+    """
+    Drop the in-process kernels, and the exported ones if `disk` is set
+    """
+    with _lock:
+        _kernels.clear()
+    if disk:
+        for path in Path(cache_dir or get_cache_dir()).glob('*_' + '?' * 20 + '.so'):
+            path.unlink()
@@ -0,0 +1,321 @@
+"""
+Locally repairable code on the tuned bitmatrix kernels
+
+ecData data fragments are split into ecLocal groups, each protected by a
+local parity (the XOR of its group), and the whole stripe by ecGlobal
+parities over GF(2^ecW). A message is the data fragments, then the local, then
+the global parity fragments, ecW rows each as in rs.py.
+
+Local and global parity rows form one (ecLocal + ecGlobal) * ecW encoder, so
+encoding is a single pass of the bitmatrix kernel tuned for
+ecParity = ecLocal + ecGlobal. A lost fragment of a group is repaired from
+the rest of its group only, with the (ecW, group * ecW) decode kernel
+(benchmark.py --decode --erasures 1 -ecData <group size>); other losses fall
+back to a global decode.
+"""
+
+from bitmatrix_autoschedule import bitmatrix_multiply, bitmatrix_decode
+import argparse
+import json
+import time
+import numpy as np
+from common import np_fill_bitmatrix, np_invert_bitmatrix, load_bitmatrix, aligned_empty
+from galois_field import GF, expand, get_cauchy_bitmatrix
+from rs import ReedSolomon
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecData', '-D', type=int, default=12)
+    parser.add_argument('-ecLocal', '-L', type=int, default=2,
+                        help='Number of local groups, one local parity each')
+    parser.add_argument('-ecGlobal', '-G', type=int, default=2,
+                        help='Number of global parities')
+    parser.add_argument('-N', type=int, default=128000)
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8',
+                        help='Word type the tuned kernels process packets in')
+    parser.add_argument('--read_log_file', '-l', required=True,
+                        help='Encode schedule tuned for ecParity = ecLocal + ecGlobal')
+    parser.add_argument('--read_decode_log_file', '-dl', default=None,
+                        help='Tuned (e * ecW, K) global decode schedules, the default schedule is used for the ones it lacks')
+    parser.add_argument('--read_repair_log_file', '-rl', default=None,
+                        help='Tuned (ecW, group * ecW) local repair schedules, the default schedule is used if not set')
+    parser.add_argument('--input_bitmatrix', default=None, type=str,
+                        help='Global parity bitmatrix file, "cauchy" for galois_field.search_cauchy, '
+                             'the powers of global_coefficients if not set')
+    parser.add_argument('--number', type=int, default=100)
+    parser.add_argument('--result_file', default='lrc.json')
+
+
+def gf2_basis(A):
+    """
+    Indices of the first rows of A that are linearly independent over GF(2),
+    in order, spanning the row space of A
+    """
+    basis = {}
+    chosen = []
+    for i, row in enumerate(A != 0):
+        row = row.copy()
+        for col, pivot_row in basis.items():
+            if row[col]:
+                row ^= pivot_row
+        nonzero = np.flatnonzero(row)
+        if nonzero.size:
+            basis[nonzero[0]] = row
+            chosen.append(i)
+    return chosen
+
+
+def global_coefficients(gf, ecData, ecGlobal):
+    """
+    (ecGlobal, ecData) global parity coefficients x_i^(r + 1), x_i = 2^i, as
+    in Azure's LRC: with XOR local parities, the ecGlobal + 1 equations seen
+    by any ecGlobal + 1 erasures form a Vandermonde-like system, so every such
+    pattern is recoverable (plain RS / Cauchy global rows do not ensure it)
+    """
+    assert ecData < (1 << gf.w)
+    x = gf.exp[np.arange(ecData)]
+    C = np.ones((ecGlobal, ecData), dtype=np.int64)
+    for r in range(ecGlobal):
+        C[r] = x if r == 0 else [gf.mul(a, b) for a, b in zip(C[r - 1], x)]
+    return C
+
+
+class LocalRepairableCode:
+    def __init__(self, argv):
+        self.argv = argv
+        ecData = argv.ecData
+        ecW = argv.ecW
+        K = ecData * ecW
+        self.ecParity = argv.ecLocal + argv.ecGlobal
+        self.num_fragments = ecData + self.ecParity
+        self.args = {
+            'ecParity': self.ecParity,
+            'N': argv.N,
+            'ecData': ecData,
+            'ecW': ecW,
+            'dtype': getattr(argv, 'dtype', 'uint8'),
+            'log_file': argv.read_log_file,
+            'verbose': 0
+        }
+        self.decode_args = dict(self.args, log_file=getattr(argv, 'read_decode_log_file', None))
+        self.repair_args = dict(self.args, log_file=getattr(argv, 'read_repair_log_file', None))
+
+        # contiguous groups, the first ones one fragment larger if needed
+        size, extra = divmod(ecData, argv.ecLocal)
+        assert size > 0, "more local groups than data fragments"
+        self.groups = []
+        start = 0
+        for j in range(argv.ecLocal):
+            end = start + size + (j < extra)
+            self.groups.append(list(range(start, end)))
+            start = end
+
+        local = np.zeros((argv.ecLocal * ecW, K), dtype=np.uint8)
+        for j, group in enumerate(self.groups):
+            for f in group:
+                local[j * ecW:(j + 1) * ecW, f * ecW:(f + 1) * ecW] = np.eye(ecW, dtype=np.uint8)
+        input_bitmatrix = getattr(argv, 'input_bitmatrix', None)
+        if input_bitmatrix == 'cauchy':
+            global_bitmatrix = get_cauchy_bitmatrix(argv.ecGlobal, ecData, ecW)
+        elif input_bitmatrix:
+            global_bitmatrix = load_bitmatrix(input_bitmatrix)
+        else:
+            global_bitmatrix = expand(GF(ecW), global_coefficients(GF(ecW), ecData, argv.ecGlobal))
+        assert global_bitmatrix.shape == (argv.ecGlobal * ecW, K)
+
+        self.bitmatrix = np.concatenate((local, global_bitmatrix != 0), axis=0).astype(np.uint8)
+        self.encoder = np_fill_bitmatrix(self.bitmatrix, self.args['dtype'])
+        self.generator = np.concatenate((np.eye(K, dtype=np.uint8), self.bitmatrix), axis=0)
+
+    def fragment_rows(self, fragments):
+        ecW = self.argv.ecW
+        return np.concatenate([np.arange(f * ecW, (f + 1) * ecW) for f in fragments])
+
+    def erase(self, msg, drop):
+        return np.delete(msg, self.fragment_rows(drop), axis=0)
+
+    def local_group(self, f):
+        """
+        Index of the local group of fragment f, None for global parities
+        """
+        ecData = self.argv.ecData
+        if f < ecData:
+            return next(j for j, group in enumerate(self.groups) if f in group)
+        if f < ecData + self.argv.ecLocal:
+            return f - ecData
+        return None
+
+    def group_fragments(self, j):
+        """
+        Data fragments of group j followed by its local parity
+        """
+        return self.groups[j] + [self.argv.ecData + j]
+
+    def encode(self, data, out=None):
+        """
+        Encode (K, N) data, local and global parity in one kernel pass
+        """
+        argv = self.argv
+        K = argv.ecData * argv.ecW
+        if out is None:
+            out = aligned_empty((self.num_fragments * argv.ecW, argv.N))
+        if not np.may_share_memory(out, data):
+            out[:K] = data
+        bitmatrix_multiply(self.args, self.encoder, data, out[K:])
+        return out
+
+    def repair(self, msg, f, out=None):
+        """
+        Rebuild fragment f of a message from the other fragments of its
+        local group only; returns (fragment, bytes read)
+        """
+        argv = self.argv
+        ecW = argv.ecW
+        j = self.local_group(f)
+        if j is None:
+            raise ValueError("global parity %d has no local group" % f)
+        helpers = [h for h in self.group_fragments(j) if h != f]
+        # the group XORs to zero, so f is the XOR of the other members
+        decoder = np_fill_bitmatrix(np.tile(np.eye(ecW, dtype=np.uint8), len(helpers)), self.args['dtype'])
+        data = np.ascontiguousarray(msg[self.fragment_rows(helpers)])
+        args = dict(self.repair_args, ecData=len(helpers), erasures=1)
+        out = bitmatrix_decode(args, decoder, data, out)
+        return out, data.nbytes
+
+    def get_decoder(self, drop):
+        """
+        (rows, decoder): K surviving message rows spanning the data, and the
+        decoder taking them back to the erased data fragments
+        """
+        argv = self.argv
+        K = argv.ecData * argv.ecW
+        survivors = [f for f in range(self.num_fragments) if f not in drop]
+        # data fragments come first, so surviving data is read as is
+        rows = self.fragment_rows(survivors)
+        rows = rows[gf2_basis(self.generator[rows])]
+        if len(rows) < K:
+            raise ValueError("erasures %s are not recoverable" % (tuple(drop),))
+        inverse = np_invert_bitmatrix(self.generator[rows])
+        lost = [f for f in sorted(drop) if f < argv.ecData]
+        return rows, np_fill_bitmatrix(inverse[self.fragment_rows(lost)], self.args['dtype'])
+
+    def decode(self, msg, drop, out=None):
+        """
+        Recover the (K, N) data of a message whose fragments in drop are
+        lost. Groups with a single loss are repaired locally, the rest is
+        decoded from the global parities.
+        """
+        argv = self.argv
+        ecW = argv.ecW
+        K = argv.ecData * ecW
+        drop = sorted(set(drop))
+        if out is None:
+            out = aligned_empty((K, msg.shape[1]), msg.dtype)
+        out[...] = msg[:K]
+
+        lost = [f for f in drop if f < argv.ecData]
+        remote = []
+        for f in lost:
+            j = self.local_group(f)
+            if len([h for h in self.group_fragments(j) if h in drop]) == 1:
+                self.repair(msg, f, out[f * ecW:(f + 1) * ecW])
+            else:
+                remote.append(f)
+        if not remote:
+            return out
+
+        rows, decoder = self.get_decoder(drop)
+        args = dict(self.decode_args, erasures=len(lost))
+        decoded = bitmatrix_decode(args, decoder, np.ascontiguousarray(msg[rows]))
+        out[self.fragment_rows(lost)] = decoded
+        return out
+
+
+def repair_benchmark(lrc, rs, number=100, seed=0):
+    """
+    Verify single-fragment repair of every data fragment with both codes,
+    and time it; returns a result record
+    """
+    argv = lrc.argv
+    ecW = argv.ecW
+    K = argv.ecData * ecW
+    rng = np.random.default_rng(seed)
+    data = aligned_empty((K, argv.N))
+    data[...] = rng.integers(0, 256, size=(K, argv.N), dtype=np.uint8)
+
+    lrc_msg = lrc.encode(data)
+    rs_msg = rs.encode(data)
+    for f in range(argv.ecData):
+        rows = slice(f * ecW, (f + 1) * ecW)
+        fragment, _ = lrc.repair(lrc_msg, f)
+        np.testing.assert_equal(fragment, data[rows], err_msg='wrong local repair of fragment %d' % f)
+        recover = rs.decode(rs.erase(rs_msg, (f,)), (f,))
+        np.testing.assert_equal(recover[rows], data[rows], err_msg='wrong RS repair of fragment %d' % f)
+
+    f = 0
+    out = aligned_empty((ecW, argv.N))
+    tic = time.perf_counter()
+    for _ in range(number):
+        _, lrc_read = lrc.repair(lrc_msg, f, out)
+    lrc_time = (time.perf_counter() - tic) / number
+
+    remain = rs.erase(rs_msg, (f,))
+    rs_read = K * argv.N
+    tic = time.perf_counter()
+    for _ in range(number):
+        rs.decode(remain, (f,))
+    rs_time = (time.perf_counter() - tic) / number
+
+    parity = aligned_empty((lrc.ecParity * ecW, argv.N))
+    tic = time.perf_counter()
+    for _ in range(number):
+        bitmatrix_multiply(lrc.args, lrc.encoder, data, parity)
+    encode_time = (time.perf_counter() - tic) / number
+
+    return {
+        'ecData': argv.ecData,
+        'ecLocal': argv.ecLocal,
+        'ecGlobal': argv.ecGlobal,
+        'N': argv.N,
+        'ecW': ecW,
+        'log_file': argv.read_log_file,
+        'verified': True,
+        'encode_time(s)': encode_time,
+        'encode_bandwidth(MB/s)': data.size / (1024**2) / encode_time,
+        'lrc_repair_read(B)': lrc_read,
+        'rs_repair_read(B)': rs_read,
+        'lrc_repair_time(s)': lrc_time,
+        'rs_repair_time(s)': rs_time,
+        'lrc_repair_bandwidth(MB/s)': out.size / (1024**2) / lrc_time,
+        'rs_repair_bandwidth(MB/s)': out.size / (1024**2) / rs_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    lrc = LocalRepairableCode(argv)
+    # RS baseline with the same storage overhead, same encode workload
+    rs = ReedSolomon(argparse.Namespace(
+        ecParity=lrc.ecParity,
+        ecData=argv.ecData,
+        ecW=argv.ecW,
+        N=argv.N,
+        dtype=argv.dtype,
+        read_log_file=argv.read_log_file,
+        read_decode_log_file=argv.read_decode_log_file,
+    ))
+    r = repair_benchmark(lrc, rs, argv.number)
+    print("repair of one fragment: LRC reads %d B at %.3f MB/s, RS reads %d B at %.3f MB/s"
+          % (r['lrc_repair_read(B)'], r['lrc_repair_bandwidth(MB/s)'],
+             r['rs_repair_read(B)'], r['rs_repair_bandwidth(MB/s)']))
+
+    with open(argv.result_file, 'w', encoding='utf-8') as f:
+        json.dump([r], f, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
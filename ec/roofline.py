@@ -0,0 +1,148 @@
+"""
+Roofline report of the tuned bitmatrix kernels
+
+Connects the STREAM numbers of bandwidth/stream.c to the EC kernels: every
+tuned configuration is run in streaming mode (data larger than the LLC) and
+in warm mode, at several thread counts, and its memory traffic (data read plus
+parity written) is reported as a percentage of the STREAM copy and triad
+bandwidth measured with the same number of threads. Configurations far below
+the peak while not much faster in cache are compute-bound and the ones worth
+more tuning.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+from bench_suite import benchmark_suite
+from common import get_physical_cpus
+
+STREAM_FUNCTIONS = ('Copy', 'Scale', 'Add', 'Triad')
+
+
+def parse_stream(text):
+    """
+    Best rates of a STREAM output, in bytes/s
+    """
+    rates = {}
+    for name in STREAM_FUNCTIONS:
+        m = re.search(r'^' + name + r':\s+([\d.]+)', text, re.MULTILINE)
+        if m:
+            # STREAM reports 10^6 bytes per second
+            rates[name.lower()] = float(m.group(1)) * 1e6
+    if 'copy' not in rates or 'triad' not in rates:
+        raise ValueError("not a STREAM output")
+    return rates
+
+
+def run_stream(binary, num_threads):
+    env = dict(os.environ, OMP_NUM_THREADS=str(num_threads))
+    output = subprocess.check_output((binary,), env=env, universal_newlines=True)
+    return parse_stream(output)
+
+
+def roofline(argv, peak, num_threads, samples=100, threshold=0.7, cpus=None):
+    """
+    Roofline record of the tuned kernel in argv pinned to num_threads
+    physical cores (the first of cpus, get_physical_cpus() by default), peak
+    being the STREAM rates with as many threads
+    """
+    cpus = list(get_physical_cpus() if cpus is None else cpus)[:num_threads]
+    a = dict(argv, modes=['warm', 'stream'], samples=samples, cpus=cpus)
+    results = {r['mode']: r for r in benchmark_suite(a)}
+    K = argv['ecData'] * argv['ecW']
+    M = argv['ecParity'] * argv['ecW']
+    # bandwidth(MB/s) counts the data read, in 2^20 bytes
+    traffic = results['stream']['bandwidth(MB/s)'] * 1024**2 * (K + M) / K
+    warm = results['warm']['bandwidth(MB/s)'] * 1024**2 * (K + M) / K
+    record = {
+        'ecParity': argv['ecParity'],
+        'N': argv['N'],
+        'ecData': argv['ecData'],
+        'ecW': argv['ecW'],
+        'dtype': argv.get('dtype', 'uint8'),
+        'log_file': argv['log_file'],
+        'threads': len(cpus),
+        'bandwidth(MB/s)': results['stream']['bandwidth(MB/s)'],
+        'traffic(GB/s)': traffic / 1e9,
+        'warm_traffic(GB/s)': warm / 1e9,
+        # one AND and one XOR per bitmatrix entry and data byte
+        'ops_per_byte': 2.0 * M * K / (K + M),
+        'stream_copy(GB/s)': peak['copy'] / 1e9,
+        'stream_triad(GB/s)': peak['triad'] / 1e9,
+        'pct_of_copy': 100.0 * traffic / peak['copy'],
+        'pct_of_triad': 100.0 * traffic / peak['triad'],
+    }
+    record['bound'] = 'memory' if traffic >= threshold * peak['copy'] else 'compute'
+    return record
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, nargs='+', default=[2, 3, 4])
+    parser.add_argument('-ecData', '-D', type=int, nargs='+', default=[8, 9, 10])
+    parser.add_argument('-N', type=int, nargs='+', default=[128000, ])
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8')
+    parser.add_argument('--log_dir', default='log/default/',
+                        help='Directory holding the P_<P>_n_<N>_D_<D>.json tuning logs')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, os.cpu_count()],
+                        help='Thread counts to run STREAM and the kernels with')
+    stream = parser.add_mutually_exclusive_group(required=True)
+    stream.add_argument('--stream_binary', default=None,
+                        help='STREAM executable built by bandwidth/compile.sh, run with OMP_NUM_THREADS per thread count')
+    stream.add_argument('--stream_output', nargs='+', default=None,
+                        help='Saved STREAM outputs, one per thread count in --threads order, or one for all')
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--threshold', type=float, default=0.7,
+                        help='Fraction of the STREAM copy bandwidth above which a config is memory-bound')
+    parser.add_argument('--result_file', default='roofline.json')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    peaks = {}
+    for i, t in enumerate(argv.threads):
+        if argv.stream_binary:
+            peaks[t] = run_stream(argv.stream_binary, t)
+        else:
+            path = argv.stream_output[min(i, len(argv.stream_output) - 1)]
+            with open(path) as f:
+                peaks[t] = parse_stream(f.read())
+
+    # before the runs pin the process to fewer cpus
+    cpus = get_physical_cpus()
+    result = []
+    print("%-6s %-6s %-8s %-7s %10s %8s %8s %s"
+          % ('P', 'D', 'N', 'threads', 'GB/s', '%copy', '%triad', 'bound'))
+    for N in argv.N:
+        for ecParity in argv.ecParity:
+            for ecData in argv.ecData:
+                log_file = argv.log_dir + 'P_' + str(ecParity) + '_n_' + str(N) + '_D_' + str(ecData) + '.json'
+                if not os.path.exists(log_file):
+                    continue
+                a = {
+                    'ecParity': ecParity,
+                    'N': N,
+                    'ecData': ecData,
+                    'ecW': argv.ecW,
+                    'dtype': argv.dtype,
+                    'log_file': log_file,
+                    'verbose': 0,
+                }
+                for t in argv.threads:
+                    r = roofline(a, peaks[t], t, argv.samples, argv.threshold, cpus)
+                    print("%-6d %-6d %-8d %-7d %10.2f %8.1f %8.1f %s"
+                          % (ecParity, ecData, N, t, r['traffic(GB/s)'],
+                             r['pct_of_copy'], r['pct_of_triad'], r['bound']))
+                    result.append(r)
+
+    with open(argv.result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Encode / decode round-trip benchmark
+
+For every (ecParity, ecData) pair, the tuned encode kernel is checked
+against the NumPy reference, random fragments are erased and decoded with
+the decode kernel, and the recovered data must match bit for bit. Encode and
+decode throughput are reported together, so a tuned log producing wrong
+parity is caught before it is shipped.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from bitmatrix_autoschedule import bitmatrix_multiply, bitmatrix_decode
+from common import aligned_empty, np_bitmatrix_multiply, np_fill_bitmatrix
+from rs import ReedSolomon
+
+
+def log_path(log_dir, ecParity, ecData, N):
+    return log_dir + 'P_' + str(ecParity) + '_n_' + str(N) + '_D_' + str(ecData) + '.json'
+
+
+def roundtrip(argv, patterns=16, number=100, seed=0):
+    """
+    Verify and time encoding and decoding of one code. argv is the namespace
+    taken by ReedSolomon. Returns a result record, raises AssertionError on
+    any mismatch.
+    """
+    rs = ReedSolomon(argv)
+    rng = np.random.default_rng(seed)
+    K = argv.ecData * argv.ecW
+    M = argv.ecParity * argv.ecW
+    dtype = np.dtype(rs.args['dtype'])
+
+    data = aligned_empty((K, argv.N))
+    data[...] = rng.integers(0, 256, size=(K, argv.N), dtype=np.uint8)
+    msg = rs.encode(data)
+    ref = np_bitmatrix_multiply(np_fill_bitmatrix(rs.bitmatrix, dtype), data.view(dtype)).view(np.uint8)
+    np.testing.assert_equal(msg[K:], ref, err_msg='wrong parity from ' + argv.read_log_file)
+
+    # the first pattern always loses as many data fragments as possible
+    n = argv.ecData + argv.ecParity
+    drops = [tuple(range(min(argv.ecParity, argv.ecData)))]
+    for _ in range(patterns - 1):
+        size = rng.integers(1, argv.ecParity + 1)
+        drops.append(tuple(sorted(rng.choice(n, size=size, replace=False).tolist())))
+    for drop in drops:
+        recover = rs.decode(rs.erase(msg, drop), drop)
+        np.testing.assert_equal(recover, data, err_msg='wrong data decoded for erasures %s' % (drop,))
+
+    parity = aligned_empty((M, argv.N))
+    tic = time.perf_counter()
+    for _ in range(number):
+        bitmatrix_multiply(rs.args, rs.encoder, data, parity)
+    encode_time = (time.perf_counter() - tic) / number
+
+    # decode throughput counts the erased data rows only
+    drop = drops[0]
+    decoder = rs.get_decoder(drop)
+    remain = np.ascontiguousarray(rs.erase(msg, drop)[:K])
+    out = aligned_empty(decoder.shape[:1] + (argv.N,))
+    decode_args = dict(rs.decode_args, erasures=len(drop))
+    tic = time.perf_counter()
+    for _ in range(number):
+        bitmatrix_decode(decode_args, decoder, remain, out)
+    decode_time = (time.perf_counter() - tic) / number
+
+    return {
+        'ecParity': argv.ecParity,
+        'N': argv.N,
+        'ecData': argv.ecData,
+        'ecW': argv.ecW,
+        'dtype': str(dtype),
+        'log_file': argv.read_log_file,
+        'decode_log_file': argv.read_decode_log_file,
+        'erasure_patterns': len(drops),
+        'verified': True,
+        'encode_time(s)': encode_time,
+        'encode_bandwidth(MB/s)': data.size / (1024**2) / encode_time,
+        'decode_time(s)': decode_time,
+        'decode_bandwidth(MB/s)': out.size / (1024**2) / decode_time,
+    }
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, nargs='+', default=[2, 3, 4])
+    parser.add_argument('-ecData', '-D', type=int, nargs='+', default=[8, 9, 10])
+    parser.add_argument('-N', type=int, default=128000)
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8')
+    parser.add_argument('--log_dir', default='log/default/',
+                        help='Directory holding the P_<P>_n_<N>_D_<D>.json encode logs')
+    parser.add_argument('--decode_log_dir', default=None,
+                        help='Directory holding decode logs of the same name, the default schedule is used if not set')
+    parser.add_argument('--input_bitmatrix_dir', default=None,
+                        help='Directory holding rs_<D>_<P>.txt encoder bitmatrices, generated by pyfinite if not set')
+    parser.add_argument('--patterns', type=int, default=16,
+                        help='Number of erasure patterns decoded per code')
+    parser.add_argument('--number', type=int, default=100)
+    parser.add_argument('--result_file', default='roundtrip.json')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    result = []
+    failed = []
+    for ecParity in argv.ecParity:
+        for ecData in argv.ecData:
+            read_log_file = log_path(argv.log_dir, ecParity, ecData, argv.N)
+            if not os.path.exists(read_log_file):
+                print("P=%d D=%d: no log %s, skipped" % (ecParity, ecData, read_log_file))
+                continue
+            a = argparse.Namespace(
+                ecParity=ecParity,
+                ecData=ecData,
+                ecW=argv.ecW,
+                N=argv.N,
+                dtype=argv.dtype,
+                read_log_file=read_log_file,
+                read_decode_log_file=log_path(argv.decode_log_dir, ecParity, ecData, argv.N)
+                if argv.decode_log_dir else None,
+                input_bitmatrix=os.path.join(argv.input_bitmatrix_dir, 'rs_%d_%d.txt' % (ecData, ecParity))
+                if argv.input_bitmatrix_dir else None,
+            )
+            try:
+                r = roundtrip(a, argv.patterns, argv.number)
+            except AssertionError as e:
+                print("P=%d D=%d: FAILED\n%s" % (ecParity, ecData, e))
+                failed.append(read_log_file)
+                result.append({'ecParity': ecParity, 'N': argv.N, 'ecData': ecData,
+                               'log_file': read_log_file, 'verified': False})
+                continue
+            print("P=%d D=%d: encode %.3f MB/s, decode %.3f MB/s"
+                  % (ecParity, ecData, r['encode_bandwidth(MB/s)'], r['decode_bandwidth(MB/s)']))
+            result.append(r)
+
+    with open(argv.result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+    if failed:
+        sys.exit("wrong results with " + ", ".join(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
-from bitmatrix_autoschedule import bitmatrix_multiply
+from bitmatrix_autoschedule import bitmatrix_multiply, bitmatrix_decode, bitmatrix_update
 from pyfinite.rs_code import RSCode
+from collections import OrderedDict
 import numpy as np
-from common import np_fill_bitmatrix
+from common import np_fill_bitmatrix, np_invert_bitmatrix, load_bitmatrix, aligned_empty
+from common import config_runtime, AFFINITY_MODES
+from galois_field import get_cauchy_bitmatrix
 import argparse
 
 def add_common_args(parser):
@@ -9,48 +12,172 @@ def add_common_args(parser):
     parser.add_argument('-N', type=int, default=128000)
     parser.add_argument('-ecData', '-D', type=int, default=10)
     parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8',
+                        help='Word type the tuned kernels process packets in')
     parser.add_argument('--read_log_file', '-l', required=True,
                         help='Run the benchmark with tuned schedule in log file')
+    parser.add_argument('--read_decode_log_file', '-dl', default=None,
+                        help='Tuned (e * ecW, K) decode schedules, per number e of erased data fragments; '
+                             'the default schedule is used for the ones it lacks')
+    parser.add_argument('--read_update_log_file', '-ul', default=None,
+                        help='Tuned parity update (delta) schedule, the default schedule is used if not set')
+    parser.add_argument('--input_bitmatrix', default=None, type=str,
+                        help='Encoder bitmatrix file, "cauchy" for the low-density Cauchy encoder '
+                             'searched by galois_field.py, generated by pyfinite if not set')
+    parser.add_argument('--decoder_cache_size', type=int, default=64,
+                        help='Number of erasure patterns to keep decoder bitmatrices for')
+    parser.add_argument('--num_threads', type=int, default=0,
+                        help='Number of TVM worker threads, 0 for all')
+    parser.add_argument('--affinity', default='big', choices=list(AFFINITY_MODES),
+                        help='TVM thread pool affinity mode')
+    parser.add_argument('--numa_node', type=int, default=None,
+                        help='Run the kernels on the physical cores of this NUMA node')
     parser.add_argument('--encode_only', '-e', action='store_true')
 
 class ReedSolomon:
+    """
+    Systematic Reed-Solomon codec running on the tuned bitmatrix kernels
+
+    A message is ((ecData + ecParity) * ecW, N): fragment f owns rows
+    [f * ecW, (f + 1) * ecW), data fragments first.
+    """
     def __init__(self, argv):
         self.argv = argv
-
-    def encode(self, data):
-        argv = self.argv
         K = argv.ecData * argv.ecW
         M = argv.ecParity * argv.ecW
-        args = {
+        self.args = {
             'ecParity': argv.ecParity,
             'N': argv.N,
             'ecData': argv.ecData,
             'ecW': argv.ecW,
+            'dtype': getattr(argv, 'dtype', 'uint8'),
             'log_file': argv.read_log_file,
             'verbose': 0
         }
-        self.encoder = RSCode(argv.ecData, argv.ecParity)
-        encoder = np.array(self.encoder.CreateEncoderBitMatrix(argv.ecW)).astype(np.uint8)
-        encoder = np_fill_bitmatrix(encoder)
-        print(encoder.shape)
-        parity = bitmatrix_multiply(args, encoder, data)
-        print(parity)
-        return np.concatenate((data, parity), axis=0)
-
-    def decode(self, remain, drop):
+        self.decode_args = dict(self.args, log_file=getattr(argv, 'read_decode_log_file', None))
+        self.update_args = dict(self.args, log_file=getattr(argv, 'read_update_log_file', None))
+
+        input_bitmatrix = getattr(argv, 'input_bitmatrix', None)
+        if input_bitmatrix == 'cauchy':
+            bitmatrix = get_cauchy_bitmatrix(argv.ecParity, argv.ecData, argv.ecW)
+        elif input_bitmatrix:
+            bitmatrix = load_bitmatrix(input_bitmatrix)
+        else:
+            rs_code = RSCode(argv.ecData, argv.ecParity)
+            bitmatrix = np.array(rs_code.CreateEncoderBitMatrix(argv.ecW)).astype(np.uint8)
+        assert bitmatrix.shape == (M, K)
+        self.bitmatrix = bitmatrix
+        # masks in the kernel word type, so calls do not convert them
+        self.encoder = np_fill_bitmatrix(bitmatrix, self.args['dtype'])
+        # systematic generator, one ecW row block per fragment
+        self.generator = np.concatenate((np.eye(K, dtype=np.uint8), bitmatrix != 0), axis=0)
+
+        num_threads = getattr(argv, 'num_threads', 0)
+        numa_node = getattr(argv, 'numa_node', None)
+        affinity = getattr(argv, 'affinity', 'big')
+        if num_threads or numa_node is not None or affinity != 'big':
+            config_runtime(num_threads, affinity, numa_node)
+
+        self.decoder_cache_size = getattr(argv, 'decoder_cache_size', 64)
+        self.decoders = OrderedDict()
+
+    def fragment_rows(self, fragments):
+        ecW = self.argv.ecW
+        return np.concatenate([np.arange(f * ecW, (f + 1) * ecW) for f in fragments])
+
+    def erase(self, msg, drop):
+        return np.delete(msg, self.fragment_rows(drop), axis=0)
+
+    def encode(self, data, out=None):
+        """
+        Encode (K, N) data into a message, the parity is written in place
+        into out (or a fresh aligned buffer) without intermediate copies
+        """
         argv = self.argv
         K = argv.ecData * argv.ecW
-        M = argv.ecParity * argv.ecW
-        args = {
-            'ecParity': argv.ecParity,
-            'N': argv.N,
-            'ecData': argv.ecData,
-            'ecW': argv.ecW,
-            'log_file': argv.read_log_file,
-            'verbose': 0
-        }
-        decoder = np.array(self.encoder.CreateDecoderBitMatrix(argv.ecW, drop)).astype(np.uint8)
-        decoder = np_fill_bitmatrix(decoder)
+        if out is None:
+            out = aligned_empty(((argv.ecData + argv.ecParity) * argv.ecW, argv.N))
+        if not np.may_share_memory(out, data):
+            out[:K] = data
+        bitmatrix_multiply(self.args, self.encoder, data, out[K:])
+        return out
+
+    def update(self, msg, f, new):
+        """
+        Overwrite data fragment f of an encoded message with the (ecW, N)
+        new contents, patching the parity in place from the old and new
+        contents only instead of re-encoding the stripe
+        """
+        argv = self.argv
+        ecW = argv.ecW
+        K = argv.ecData * ecW
+        assert 0 <= f < argv.ecData
+        rows = slice(f * ecW, (f + 1) * ecW)
+        columns = np.ascontiguousarray(self.encoder[:, rows])
+        bitmatrix_update(self.update_args, columns, msg[rows], new, msg[K:])
+        msg[rows] = new
+        return msg
+
+    def get_decoder(self, drop):
+        """
+        Decoder bitmatrix taking the first ecData surviving fragments back to
+        the erased data fragments, memoized per erasure pattern
+        """
+        drop = tuple(sorted(set(drop)))
+        decoder = self.decoders.get(drop)
+        if decoder is not None:
+            self.decoders.move_to_end(drop)
+            return decoder
+
+        argv = self.argv
+        if len(drop) > argv.ecParity:
+            raise ValueError("cannot recover from %d erasures with %d parity fragments"
+                             % (len(drop), argv.ecParity))
+        survivors = [f for f in range(argv.ecData + argv.ecParity) if f not in drop]
+        rows = self.fragment_rows(survivors[:argv.ecData])
+        inverse = np_invert_bitmatrix(self.generator[rows])
+        lost = [f for f in drop if f < argv.ecData]
+        decoder = np_fill_bitmatrix(inverse[self.fragment_rows(lost)], self.args['dtype'])
+
+        self.decoders[drop] = decoder
+        while len(self.decoders) > self.decoder_cache_size:
+            self.decoders.popitem(last=False)
+        return decoder
+
+    def decode(self, remain, drop, out=None):
+        """
+        Recover the (K, N) data from the surviving fragments. Surviving data
+        fragments are copied, only the rows of the erased ones are computed,
+        by the decode kernel tuned for that number of erasures.
+        """
+        argv = self.argv
+        ecW = argv.ecW
+        K = argv.ecData * ecW
+        lost = sorted(f for f in set(drop) if f < argv.ecData)
+        if not lost:
+            # only parity was lost, the data fragments are intact
+            if out is None:
+                return remain[:K]
+            out[...] = remain[:K]
+            return out
+
+        if out is None:
+            out = aligned_empty((K, remain.shape[1]), remain.dtype)
+        survivors = [f for f in range(argv.ecData + argv.ecParity) if f not in drop]
+        for i, f in enumerate(survivors[:argv.ecData]):
+            if f < argv.ecData:
+                out[f * ecW:(f + 1) * ecW] = remain[i * ecW:(i + 1) * ecW]
+
+        decoder = self.get_decoder(drop)
+        args = dict(self.decode_args, erasures=len(lost))
+        data = np.ascontiguousarray(remain[:K])
+        if lost[-1] - lost[0] == len(lost) - 1:
+            # consecutive fragments, decode in place
+            bitmatrix_decode(args, decoder, data, out[lost[0] * ecW:(lost[-1] + 1) * ecW])
+        else:
+            decoded = bitmatrix_decode(args, decoder, data)
+            out[self.fragment_rows(lost)] = decoded
+        return out
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -62,9 +189,11 @@ if __name__ == '__main__':
     data = np.random.randint(np.iinfo(np.uint8).max,
                                 size=(K, argv.N)).astype(np.uint8)
     msg = rs.encode(data)
+    if argv.encode_only:
+        exit(0)
     drop = (1, 2, 3, 4)
-    # remain = np.delete(msg, drop, axis=0)
+    remain = rs.erase(msg, drop)
     print(remain.shape)
     recover = rs.decode(remain, drop)
 
-    print(np.array_equal(data, recover))
\ No newline at end of file
+    print(np.array_equal(data, recover))
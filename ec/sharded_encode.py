@@ -0,0 +1,234 @@
+"""
+Multi-process sharded encoder for large objects
+
+One bitmatrix_multiply call runs in one process and needs the whole object in
+its memory. Here the stripes of an object are split into contiguous shards
+encoded by a pool of worker processes, spread over the NUMA nodes, each
+pinned to its own physical cores and holding its compiled kernel from
+start-up. Workers map the input (a file, or a shared memory copy of an
+in-memory object) and the pre-sized fragment files, so neither data nor
+parity goes through the parent. The fragment files and meta.json have the
+layout of stream_encode.
+"""
+
+import argparse
+import json
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+import numpy as np
+import tvm
+from bitmatrix_autoschedule import get_cached_func
+from common import aligned_empty, as_tvm_array, as_words, as_mask_words
+from common import config_runtime, get_numa_nodes, get_physical_cpus
+from rs import ReedSolomon, add_common_args as rs_add_common_args
+from stream_encode import fragment_path
+
+# per worker process state, set by _init_worker
+_worker = {}
+
+
+def assign_cpus(num_workers):
+    """
+    Cpu list of every worker: workers go round-robin over the NUMA nodes and
+    share the physical cores of their node evenly
+    """
+    nodes = get_numa_nodes()
+    per_node = {node: [w for w in range(num_workers) if nodes[w % len(nodes)] == node] for node in nodes}
+    assignment = [None] * num_workers
+    for node, workers in per_node.items():
+        if not workers:
+            continue
+        cpus = get_physical_cpus(node)
+        share = max(1, len(cpus) // len(workers))
+        for i, w in enumerate(workers):
+            assignment[w] = cpus[i * share:(i + 1) * share] or cpus[-1:]
+    return assignment
+
+
+def _init_worker(argv, encoder, cpu_queue, barrier):
+    cpus = cpu_queue.get()
+    if cpus:
+        config_runtime(affinity='pin', cpus=cpus)
+    dev = tvm.cpu()
+    dtype = argv.get('dtype', 'uint8')
+    K = argv['ecData'] * argv['ecW']
+    M = argv['ecParity'] * argv['ecW']
+    in_buf = aligned_empty((K, argv['N']))
+    out_buf = aligned_empty((M, argv['N']))
+    _worker.update({
+        'argv': argv,
+        'dtype': dtype,
+        'dev': dev,
+        'func': get_cached_func(argv),
+        'a_tvm': as_tvm_array(as_mask_words(encoder, dtype), dev),
+        'in_buf': in_buf,
+        'out_buf': out_buf,
+        'in_tvm': as_tvm_array(as_words(in_buf, dtype), dev),
+        'out_tvm': as_tvm_array(as_words(out_buf, dtype), dev),
+        'cpus': cpus,
+        'barrier': barrier,
+    })
+
+
+def _wait_ready():
+    """
+    Block until every worker has started and loaded its kernel
+    """
+    _worker['barrier'].wait()
+    return os.getpid()
+
+
+def _encode_shard(source, size, out_dir, start, stop):
+    """
+    Encode stripes [start, stop) of the object into the fragment files
+    """
+    argv = _worker['argv']
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    K = ecData * ecW
+    packet = ecW * N
+    stripe_bytes = K * N
+
+    kind, name = source
+    shm = None
+    if kind == 'file':
+        # copy-on-write maps are writeable, so aligned stripes go to the
+        # kernel without copies; the kernel never writes its input
+        data = np.memmap(name, dtype=np.uint8, mode='c', shape=(size,))
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        data = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+    fragments = [np.memmap(fragment_path(out_dir, f), dtype=np.uint8, mode='r+')
+                 for f in range(ecData + ecParity)]
+
+    dtype = _worker['dtype']
+    out_buf = _worker['out_buf']
+    func = _worker['func']
+    chunk = stripe = b_tvm = None
+    try:
+        for i in range(start, stop):
+            chunk = data[i * stripe_bytes:(i + 1) * stripe_bytes]
+            if chunk.size == stripe_bytes:
+                stripe = chunk
+                b_tvm = as_tvm_array(as_words(chunk.reshape(K, N), dtype), _worker['dev'])
+            else:
+                # only the last stripe is padded
+                stripe = _worker['in_buf'].reshape(-1)
+                stripe[:chunk.size] = chunk
+                stripe[chunk.size:] = 0
+                b_tvm = _worker['in_tvm']
+            func(_worker['a_tvm'], b_tvm, _worker['out_tvm'])
+            for f in range(ecData):
+                fragments[f][i * packet:(i + 1) * packet] = stripe[f * packet:(f + 1) * packet]
+            for f in range(ecParity):
+                fragments[ecData + f][i * packet:(i + 1) * packet] = out_buf[f * ecW:(f + 1) * ecW].reshape(-1)
+        for fragment in fragments:
+            fragment.flush()
+    finally:
+        # DLPack views keep the shared memory exported, drop them first
+        del data, chunk, stripe, b_tvm
+        if shm is not None:
+            shm.close()
+    return stop - start, os.getpid(), _worker['cpus']
+
+
+def sharded_encode(argv, encoder, source, out_dir, num_workers=None, shards_per_worker=4):
+    """
+    Encode `source` (a file path or a bytes-like object) with a pool of
+    num_workers processes into fragment files in out_dir, plus meta.json
+    """
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    K = ecData * ecW
+    packet = ecW * N
+    num_workers = num_workers or len(get_numa_nodes())
+
+    shm = None
+    if isinstance(source, (str, Path)):
+        size = os.path.getsize(source)
+        shared = ('file', str(source))
+    else:
+        buf = np.frombuffer(source, dtype=np.uint8)
+        size = buf.size
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)[:] = buf
+        shared = ('shm', shm.name)
+
+    num_stripes = -(-size // (K * N))
+    Path(out_dir).mkdir(exist_ok=True, parents=True)
+    for f in range(ecData + ecParity):
+        with open(fragment_path(out_dir, f), 'wb') as fh:
+            fh.truncate(num_stripes * packet)
+
+    # TVM runtime threads do not survive fork
+    ctx = multiprocessing.get_context('spawn')
+    cpu_queue = ctx.Queue()
+    for cpus in assign_cpus(num_workers):
+        cpu_queue.put(cpus)
+    barrier = ctx.Barrier(num_workers)
+    num_shards = min(num_stripes, num_workers * shards_per_worker)
+    bounds = np.linspace(0, num_stripes, num_shards + 1).astype(int)
+
+    try:
+        with ProcessPoolExecutor(num_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(argv, encoder, cpu_queue, barrier)) as pool:
+            # start every worker and load its kernel before timing
+            for future in [pool.submit(_wait_ready) for _ in range(num_workers)]:
+                future.result()
+            tic = time.perf_counter()
+            futures = [pool.submit(_encode_shard, shared, size, str(out_dir), start, stop)
+                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            workers = {}
+            for future in futures:
+                stripes, pid, cpus = future.result()
+                workers.setdefault(pid, {'stripes': 0, 'cpus': cpus})['stripes'] += stripes
+            elapsed = time.perf_counter() - tic
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    meta = {
+        'ecParity': ecParity,
+        'ecData': ecData,
+        'ecW': ecW,
+        'N': N,
+        'size': size,
+        'stripes': num_stripes,
+    }
+    with open(Path(out_dir) / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=4)
+    return dict(meta, **{
+        'workers': len(workers),
+        'shards': len(futures),
+        'worker_stripes': [w['stripes'] for w in workers.values()],
+        'worker_cpus': [w['cpus'] for w in workers.values()],
+        'encode_time(s)': elapsed,
+        'bandwidth(MB/s)': size / (1024**2) / elapsed if elapsed else 0.0,
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    rs_add_common_args(parser)
+    parser.add_argument('--input', '-i', required=True,
+                        help='File to encode')
+    parser.add_argument('--out_dir', '-o', required=True,
+                        help='Directory to write the fragments to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of encoder processes, one per NUMA node by default')
+    parser.add_argument('--shards_per_worker', type=int, default=4,
+                        help='Number of stripe ranges queued per worker, for load balancing')
+    argv = parser.parse_args()
+
+    rs = ReedSolomon(argv)
+    print(sharded_encode(rs.args, rs.encoder, argv.input, argv.out_dir,
+                         argv.workers, argv.shards_per_worker))
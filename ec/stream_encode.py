@@ -0,0 +1,157 @@
+"""
+Streaming stripe encoder
+
+The input (a file, memory-mapped, or an iterable of buffers) is cut into
+stripes of K * N bytes, each viewed as the (K, N) data matrix of the tuned
+kernel. Data and parity fragments are appended to one file per fragment.
+Host buffers are double-buffered: while stripe i is encoded, stripe i + 1 is
+copied in by a reader thread and stripe i - 1 is written out by a writer
+thread.
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import tvm
+from bitmatrix_autoschedule import get_cached_func
+from common import aligned_empty, as_tvm_array, as_words, as_mask_words
+from rs import ReedSolomon, add_common_args as rs_add_common_args
+
+
+def iter_stripes(source, stripe_bytes):
+    """
+    Yield (stripe, nbytes) pairs, stripe being a uint8 array of stripe_bytes
+    with the last one zero padded and nbytes its number of valid bytes
+    """
+    if isinstance(source, (str, Path)):
+        if os.path.getsize(source) == 0:
+            return
+        data = np.memmap(source, dtype=np.uint8, mode='r')
+        for off in range(0, data.size, stripe_bytes):
+            chunk = data[off:off + stripe_bytes]
+            if chunk.size < stripe_bytes:
+                padded = np.zeros(stripe_bytes, dtype=np.uint8)
+                padded[:chunk.size] = chunk
+                yield padded, chunk.size
+            else:
+                yield chunk, stripe_bytes
+        return
+
+    stripe = np.zeros(stripe_bytes, dtype=np.uint8)
+    filled = 0
+    for buf in source:
+        buf = np.frombuffer(buf, dtype=np.uint8)
+        while buf.size:
+            n = min(buf.size, stripe_bytes - filled)
+            stripe[filled:filled + n] = buf[:n]
+            filled += n
+            buf = buf[n:]
+            if filled == stripe_bytes:
+                yield stripe, stripe_bytes
+                stripe = np.zeros(stripe_bytes, dtype=np.uint8)
+                filled = 0
+    if filled:
+        yield stripe, filled
+
+
+def fragment_path(out_dir, f):
+    return Path(out_dir) / ('frag_' + str(f))
+
+
+def stream_encode(argv, encoder, source, out_dir):
+    """
+    Encode `source` stripe by stripe into ecData + ecParity fragment files in
+    `out_dir`, plus a meta.json recording the geometry and object size
+    """
+    ecParity = argv['ecParity']
+    ecData = argv['ecData']
+    ecW = argv['ecW']
+    N = argv['N']
+    M = ecParity * ecW
+    K = ecData * ecW
+    packet = ecW * N
+
+    dtype = argv.get('dtype', 'uint8')
+    func = get_cached_func(argv)
+    dev = tvm.cpu()
+    a_tvm = as_tvm_array(as_mask_words(encoder, dtype), dev)
+    in_bufs = [aligned_empty((K, N)) for _ in range(2)]
+    out_bufs = [aligned_empty((M, N)) for _ in range(2)]
+    # the kernel works on (K, N // itemsize) words of the same bytes
+    in_tvm = [as_tvm_array(as_words(buf, dtype), dev) for buf in in_bufs]
+    out_tvm = [as_tvm_array(as_words(buf, dtype), dev) for buf in out_bufs]
+
+    Path(out_dir).mkdir(exist_ok=True, parents=True)
+    files = [open(fragment_path(out_dir, f), 'wb') for f in range(ecData + ecParity)]
+
+    def load(i, stripe):
+        np.copyto(in_bufs[i % 2], stripe.reshape(K, N))
+
+    def write(i, stripe):
+        parity = out_bufs[i % 2]
+        for f in range(ecData):
+            stripe[f * packet:(f + 1) * packet].tofile(files[f])
+        for f in range(ecParity):
+            parity[f * ecW:(f + 1) * ecW].tofile(files[ecData + f])
+
+    size = 0
+    num_stripes = 0
+    reader = ThreadPoolExecutor(max_workers=1)
+    writer = ThreadPoolExecutor(max_workers=1)
+    try:
+        stripes = iter_stripes(source, K * N)
+        nxt = next(stripes, None)
+        loading = reader.submit(load, 0, nxt[0]) if nxt else None
+        writing = [None, None]
+        i = 0
+        while loading:
+            stripe, nbytes = nxt
+            loading.result()
+            nxt = next(stripes, None)
+            loading = reader.submit(load, i + 1, nxt[0]) if nxt else None
+
+            # out_bufs[i % 2] is free once stripe i - 2 has been written
+            if writing[i % 2]:
+                writing[i % 2].result()
+            func(a_tvm, in_tvm[i % 2], out_tvm[i % 2])
+            writing[i % 2] = writer.submit(write, i, stripe)
+
+            size += nbytes
+            num_stripes += 1
+            i += 1
+        for w in writing:
+            if w:
+                w.result()
+    finally:
+        reader.shutdown()
+        writer.shutdown()
+        for fh in files:
+            fh.close()
+
+    meta = {
+        'ecParity': ecParity,
+        'ecData': ecData,
+        'ecW': ecW,
+        'N': N,
+        'size': size,
+        'stripes': num_stripes,
+    }
+    with open(Path(out_dir) / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=4)
+    return meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    rs_add_common_args(parser)
+    parser.add_argument('--input', '-i', required=True,
+                        help='File to encode')
+    parser.add_argument('--out_dir', '-o', required=True,
+                        help='Directory to write the fragments to')
+    argv = parser.parse_args()
+
+    rs = ReedSolomon(argv)
+    print(stream_encode(rs.args, rs.encoder, argv.input, argv.out_dir))
@@ -1,5 +1,6 @@
 import argparse
-from common import get_tvm_target_string
+from common import get_tvm_target_string, np_expand_bitmatrix
+from kernel_cache import get_kernel
 import numpy as np
 import tvm
 from tvm import te, auto_scheduler
@@ -18,6 +19,33 @@ def expand(M, K, ecW, dtype):
 
     return [A, out]
 
+def get_expand_func(M, ecData, ecW=8, dtype="uint8"):
+    """
+    Build (or fetch from the kernel cache) an untuned expand kernel
+    """
+    target = get_tvm_target_string()
+
+    def build():
+        A, out = expand(M, ecData * ecW, ecW, dtype)
+        s = te.create_schedule(out.op)
+        s[out].vectorize(s[out].op.axis[1])
+        return tvm.build(s, [A, out], target)
+
+    return get_kernel('expand', (M, ecData, ecW, dtype, target), build)
+
+def tvm_expand_bitmatrix(A):
+    """
+    TVM counterpart of np_expand_bitmatrix for uint8 bitmatrices
+    """
+    M, ecData = A.shape
+    ecW = 8
+    func = get_expand_func(M, ecData, ecW, "uint8")
+    dev = tvm.cpu()
+    a_tvm = tvm.nd.array(A, device=dev)
+    out_tvm = tvm.nd.empty((M, ecData * ecW), dtype="uint8", device=dev)
+    func(a_tvm, out_tvm)
+    return out_tvm.numpy()
+
 def add_common_args(parser):
     parser.add_argument('-M', type=int, default=1)
     parser.add_argument('-ecData', type=int, default=1)
@@ -69,8 +97,8 @@ def main():
     func(a_tvm, out_tvm)
 
     # Check results
-    print(a_np)
-    print(out_tvm.numpy())
+    np.testing.assert_equal(np_expand_bitmatrix(a_np), out_tvm.numpy())
+    np.testing.assert_equal(np_expand_bitmatrix(a_np), tvm_expand_bitmatrix(a_np))
 
     evaluator = func.time_evaluator(func.entry_name, dev, number=50)
     ex_time = np.median(evaluator(a_tvm, out_tvm).results)
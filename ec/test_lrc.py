@@ -0,0 +1,69 @@
+"""
+Locally repairable code checks that need no tuning log
+
+No log file is given, so kernels are built with the default schedule (see
+bitmatrix_autoschedule.apply_best_or_default). Run with pytest from ec/, or
+as a script.
+"""
+
+import argparse
+import itertools
+import numpy as np
+import pytest
+from lrc import LocalRepairableCode
+
+
+def make_lrc(dtype='uint8', N=256):
+    return LocalRepairableCode(argparse.Namespace(
+        ecData=12, ecLocal=2, ecGlobal=2, ecW=8, N=N, dtype=dtype,
+        read_log_file=None, read_decode_log_file=None, read_repair_log_file=None,
+        input_bitmatrix=None))
+
+
+def encoded(lrc, seed=0):
+    rng = np.random.default_rng(seed)
+    K = lrc.argv.ecData * lrc.argv.ecW
+    data = rng.integers(0, 256, size=(K, lrc.argv.N), dtype=np.uint8)
+    return data, lrc.encode(data)
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint32'])
+def test_repair(dtype):
+    lrc = make_lrc(dtype)
+    data, msg = encoded(lrc)
+    ecW = lrc.argv.ecW
+    ecData = lrc.argv.ecData
+    for f in range(ecData + lrc.argv.ecLocal):
+        lost = msg.copy()
+        lost[f * ecW:(f + 1) * ecW] = 0
+        fragment, read = lrc.repair(lost, f)
+        np.testing.assert_equal(msg[f * ecW:(f + 1) * ecW], fragment, err_msg="fragment %d" % f)
+        group = lrc.group_fragments(lrc.local_group(f))
+        assert read == (len(group) - 1) * ecW * lrc.argv.N
+
+    with pytest.raises(ValueError):
+        lrc.repair(msg, lrc.num_fragments - 1)
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint32'])
+def test_decode(dtype):
+    lrc = make_lrc(dtype)
+    data, msg = encoded(lrc)
+    # every pattern of up to three erasures is recoverable
+    for e in range(4):
+        for drop in itertools.combinations(range(lrc.num_fragments), e):
+            lost = msg.copy()
+            if drop:
+                lost[lrc.fragment_rows(drop)] = 0
+            np.testing.assert_equal(data, lrc.decode(lost, drop), err_msg="drop %s" % (drop,))
+
+    with pytest.raises(ValueError):
+        # a whole local group and more than the global parities can cover
+        lrc.decode(msg, lrc.group_fragments(0))
+
+
+if __name__ == '__main__':
+    for dtype in ('uint8', 'uint32'):
+        test_repair(dtype)
+        test_decode(dtype)
+    print("ok")
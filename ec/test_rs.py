@@ -0,0 +1,143 @@
+"""
+Reed-Solomon codec checks that need no tuning log
+
+No log file is given, so kernels are built with the default schedule (see
+bitmatrix_autoschedule.apply_best_or_default). Run with pytest from ec/, or
+as a script.
+"""
+
+import argparse
+import itertools
+from pathlib import Path
+import numpy as np
+import pytest
+from bitmatrix_autoschedule import bitmatrix_multiply_packed
+from bitmatrix_const import xor_schedule, xor_count
+from common import np_invert_bitmatrix, np_bitmatrix_multiply, np_fill_bitmatrix, load_bitmatrix
+from common import np_pack_bitmatrix
+from galois_field import GF
+from gf_autoschedule import GF8, np_gf_mul, np_nibble_tables, get_nibble_tables
+from rs import ReedSolomon
+
+ENCODER = Path(__file__).parent / 'xorslp_enc_matrix' / 'rs_10_4.txt'
+
+
+def make_rs(dtype='uint8', N=256):
+    return ReedSolomon(argparse.Namespace(
+        ecParity=4, ecData=10, ecW=8, N=N, dtype=dtype,
+        read_log_file=None, read_decode_log_file=None, read_update_log_file=None,
+        input_bitmatrix=str(ENCODER)))
+
+
+def random_data(rs, seed=0):
+    rng = np.random.default_rng(seed)
+    K = rs.argv.ecData * rs.argv.ecW
+    return rng.integers(0, 256, size=(K, rs.argv.N), dtype=np.uint8)
+
+
+def test_invert_bitmatrix():
+    rng = np.random.default_rng(0)
+    for n in (1, 8, 40):
+        while True:
+            A = rng.integers(0, 2, size=(n, n), dtype=np.uint8)
+            try:
+                inverse = np_invert_bitmatrix(A * 255)
+                break
+            except ValueError:
+                continue
+        np.testing.assert_equal((A.astype(int) @ inverse) % 2, np.eye(n, dtype=int))
+
+    with pytest.raises(ValueError):
+        np_invert_bitmatrix(np.array([[1, 1], [1, 1]], dtype=np.uint8))
+
+
+def test_xor_schedule():
+    bitmatrix = load_bitmatrix(ENCODER)
+    K = bitmatrix.shape[1]
+    data = np.random.default_rng(0).integers(0, 256, size=(K, 64), dtype=np.uint8)
+    expected = np_bitmatrix_multiply(np_fill_bitmatrix(bitmatrix), data)
+    naive = xor_count(*xor_schedule(bitmatrix, cse=False))
+    for cse in (False, True):
+        temps, rows = xor_schedule(bitmatrix, cse)
+        v = list(data)
+        for a, b in temps:
+            v.append(v[a] ^ v[b])
+        for i, r in enumerate(rows):
+            out = np.zeros(data.shape[1], dtype=np.uint8)
+            for x in r:
+                out ^= v[x]
+            np.testing.assert_equal(expected[i], out)
+        assert xor_count(temps, rows) <= naive
+
+
+def test_nibble_tables():
+    gf = GF(8)
+    rng = np.random.default_rng(0)
+    C = rng.integers(0, 256, size=(4, 10), dtype=np.uint8)
+    b = np.arange(256)
+    tables = np_nibble_tables(gf, C)
+    assert tables.shape == (4, 10, 32)
+    for i, k in itertools.product(range(4), range(10)):
+        # c * b = lo[b & 15] ^ hi[b >> 4]
+        looked_up = tables[i, k, b & 15] ^ tables[i, k, 16 + (b >> 4)]
+        np.testing.assert_equal(np_gf_mul(gf, C[i, k], b), looked_up)
+    np.testing.assert_equal(get_nibble_tables(C), tables)
+    # products by 1 and 0
+    np.testing.assert_equal(np_gf_mul(GF8, 1, b), b.astype(np.uint8))
+    np.testing.assert_equal(np_gf_mul(GF8, 0, b), np.zeros(256, dtype=np.uint8))
+
+
+def test_packed():
+    rs = make_rs()
+    data = random_data(rs)
+    packed = np_pack_bitmatrix(rs.bitmatrix)
+    assert packed.shape == (rs.argv.ecParity * rs.argv.ecW, rs.argv.ecData)
+    parity = bitmatrix_multiply_packed(rs.args, packed, data)
+    np.testing.assert_equal(np_bitmatrix_multiply(rs.encoder, data), parity)
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint32'])
+def test_decode(dtype):
+    rs = make_rs(dtype)
+    data = random_data(rs)
+    msg = rs.encode(data)
+    fragments = rs.argv.ecData + rs.argv.ecParity
+    patterns = [(0,), (13,), (0, 1), (2, 7), (10, 11, 12, 13),
+                (0, 1, 2, 3), (1, 4, 9, 12), (9, 3, 5)]
+    for drop in patterns:
+        recovered = rs.decode(rs.erase(msg, drop), drop)
+        np.testing.assert_equal(data, recovered, err_msg="drop %s" % (drop,))
+    # every pair
+    for drop in itertools.combinations(range(fragments), 2):
+        np.testing.assert_equal(data, rs.decode(rs.erase(msg, drop), drop))
+
+    with pytest.raises(ValueError):
+        drop = (0, 1, 2, 3, 4)
+        rs.decode(rs.erase(msg, drop), drop)
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint32'])
+def test_update(dtype):
+    rs = make_rs(dtype)
+    data = random_data(rs)
+    msg = rs.encode(data)
+    ecW = rs.argv.ecW
+    rng = np.random.default_rng(1)
+    for f in (0, 5, rs.argv.ecData - 1):
+        new = rng.integers(0, 256, size=(ecW, rs.argv.N), dtype=np.uint8)
+        rs.update(msg, f, new)
+        data[f * ecW:(f + 1) * ecW] = new
+        np.testing.assert_equal(rs.encode(data), msg, err_msg="fragment %d" % f)
+    drop = (0, 5, 11)
+    np.testing.assert_equal(data, rs.decode(rs.erase(msg, drop), drop))
+
+
+if __name__ == '__main__':
+    test_invert_bitmatrix()
+    test_xor_schedule()
+    test_nibble_tables()
+    test_packed()
+    for dtype in ('uint8', 'uint32'):
+        test_decode(dtype)
+        test_update(dtype)
+    print("ok")
@@ -0,0 +1,83 @@
+"""
+Thread-count scaling of the tuned bitmatrix kernel
+
+Runs the streaming mode of the benchmark suite with 1..ncores TVM workers on
+the physical cores of one NUMA node (or of the machine) and reports the
+saturation point: the fewest threads reaching a given fraction of the best
+bandwidth. An encode service only needs to reserve that many cores.
+"""
+
+import argparse
+import json
+from bench_suite import benchmark_suite
+from common import config_runtime, get_physical_cpus
+
+
+def thread_scaling(argv, threads, affinity='pin', numa_node=None, saturation=0.95):
+    """
+    Bandwidth per thread count; returns (records, saturation thread count)
+    """
+    cpus = get_physical_cpus(numa_node)
+    records = []
+    for t in threads:
+        used = config_runtime(t, affinity, cpus=cpus[:t])
+        r = benchmark_suite(dict(argv, modes=['stream']))[0]
+        r.update({'threads': t, 'affinity': affinity, 'numa_node': numa_node, 'cpus': used})
+        records.append(r)
+
+    best = max(r['bandwidth(MB/s)'] for r in records)
+    saturated = min(r['threads'] for r in records if r['bandwidth(MB/s)'] >= saturation * best)
+    for r in records:
+        r['saturation_threads'] = saturated
+    return records, saturated
+
+
+def add_common_args(parser):
+    parser.add_argument('-ecParity', '-P', type=int, default=4)
+    parser.add_argument('-N', type=int, default=128000)
+    parser.add_argument('-ecData', '-D', type=int, default=10)
+    parser.add_argument('-ecW', type=int, default=8)
+    parser.add_argument('--dtype', default='uint8')
+    parser.add_argument('--read_log_file', '-l', required=True,
+                        help='Run the benchmark with tuned schedule in log file')
+    parser.add_argument('--numa_node', type=int, default=None,
+                        help='Only use the physical cores of this NUMA node')
+    parser.add_argument('--affinity', default='pin', choices=['pin', 'share'],
+                        help='One core per worker thread, or all workers sharing the cores')
+    parser.add_argument('--max_threads', type=int, default=None,
+                        help='Largest thread count, all physical cores by default')
+    parser.add_argument('--saturation', type=float, default=0.95,
+                        help='Fraction of the best bandwidth counted as saturated')
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--result_file', default='thread_scaling.json')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_common_args(parser)
+    argv = parser.parse_args()
+
+    ncores = len(get_physical_cpus(argv.numa_node))
+    threads = range(1, min(ncores, argv.max_threads or ncores) + 1)
+    a = {
+        'ecParity': argv.ecParity,
+        'N': argv.N,
+        'ecData': argv.ecData,
+        'ecW': argv.ecW,
+        'dtype': argv.dtype,
+        'log_file': argv.read_log_file,
+        'samples': argv.samples,
+        'verbose': 0,
+    }
+    records, saturated = thread_scaling(a, threads, argv.affinity, argv.numa_node, argv.saturation)
+    for r in records:
+        print("threads=%d: %.3f MB/s (p5 %.3f, p95 %.3f)"
+              % (r['threads'], r['bandwidth(MB/s)'], r['p5(MB/s)'], r['p95(MB/s)']))
+    print("saturated at %d threads" % saturated)
+
+    with open(argv.result_file, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == '__main__':
+    main()
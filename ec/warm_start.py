@@ -0,0 +1,116 @@
+"""
+Transfer-learned warm start
+
+Bitmatrix DAGs of neighboring geometries (e.g. P=3,D=9 and P=3,D=10) only
+differ in their extents, so the schedules tuned for one are good starting
+points for the other. The best records of the neighbors' logs are re-targeted
+to the new task (workload key, target and split factors) and used to train
+the cost model and seed the evolutionary search of the SketchPolicy.
+"""
+
+import glob
+import json
+import math
+import os
+import re
+import numpy as np
+from tvm import auto_scheduler
+
+LOG_NAME = re.compile(r'P_(\d+)_n_(\d+)_D_(\d+)\.json$')
+
+
+def neighbor_logs(log_dir, ecParity, ecData, N, prefix='', count=2):
+    """
+    Tuning logs of the `count` geometries closest to (ecParity, ecData)
+    with the same packet size, found in log_dir by the benchmark naming
+    """
+    logs = []
+    for path in glob.glob(os.path.join(log_dir, prefix + 'P_*_n_' + str(N) + '_D_*.json')):
+        m = LOG_NAME.search(path)
+        if m is None:
+            continue
+        P, D = int(m.group(1)), int(m.group(3))
+        if (P, D) == (ecParity, ecData) or os.path.getsize(path) == 0:
+            continue
+        logs.append((abs(P - ecParity) + abs(D - ecData), path))
+    return [path for _, path in sorted(logs)[:count]]
+
+
+def retarget_lengths(lengths, extent):
+    """
+    Shrink split factors, innermost first, so their product divides extent
+    """
+    lengths = list(lengths)
+    prod = 1
+    for i in reversed(range(len(lengths))):
+        if lengths[i] is None:
+            continue
+        lengths[i] = math.gcd(lengths[i], extent // prod)
+        prod *= lengths[i]
+    return lengths
+
+
+def retarget_record(record, task, extents):
+    """
+    Rewrite a JSON record for `task`; extents maps the extents of the
+    source workload to the ones of the task
+    """
+    record = json.loads(record)
+    inp = record['i']
+    inp[0][0] = task.workload_key
+    inp[0][1] = str(task.target)
+    for step in inp[1][1]:
+        if step[0] == 'SP' and step[3] in extents:
+            step[3] = extents[step[3]]
+            step[4] = retarget_lengths(step[4], step[3])
+    return json.dumps(record)
+
+
+def retarget_logs(task, log_files, out_file, top_k=64):
+    """
+    Write the top_k valid records of each log with the same workload
+    function as `task` to out_file, re-targeted to the task.
+    Returns the number of records written.
+    """
+    name, *shape = json.loads(task.workload_key)
+    written = 0
+    with open(out_file, 'w') as out:
+        for log_file in log_files:
+            best = {}
+            with open(log_file) as f:
+                for line in f:
+                    record = json.loads(line)
+                    src_name, *src_shape = json.loads(record['i'][0][0])
+                    if src_name != name or len(src_shape) != len(shape) or record['r'][1] != 0:
+                        continue
+                    key = tuple(src_shape)
+                    best.setdefault(key, []).append((np.mean(record['r'][0]), line))
+            for src_shape, records in best.items():
+                # extents shared by two dimensions are ambiguous, keep them
+                extents = {}
+                for a, b in zip(src_shape, shape):
+                    if isinstance(a, int):
+                        extents[a] = b if extents.get(a, b) == b else None
+                extents = {a: b for a, b in extents.items() if b is not None and a != b}
+                for _, line in sorted(records, key=lambda r: r[0])[:top_k]:
+                    out.write(retarget_record(line, task, extents) + '\n')
+                    written += 1
+    return written
+
+
+def warm_start_policy(task, log_files, seed_file, top_k=64, verbose=0):
+    """
+    SketchPolicy for `task` whose cost model is trained on, and whose search
+    is seeded with, the re-targeted records of log_files. The records are
+    written to seed_file. Returns None if there is nothing to start from.
+    """
+    if not log_files or retarget_logs(task, log_files, seed_file, top_k) == 0:
+        return None
+    cost_model = auto_scheduler.XGBModel()
+    cost_model.update_from_file(seed_file)
+    return auto_scheduler.SketchPolicy(
+        task,
+        cost_model,
+        verbose=verbose,
+        init_search_callbacks=[auto_scheduler.PreloadMeasuredStates(seed_file)],
+    )
@@ -90,3 +90,14 @@ def llvm_version_major(allow_none=False):
         if allow_none:
             return None
         raise RuntimeError("LLVM version is not available, please check if you built TVM with LLVM")
+
+
+def llvm_get_system_cpu():
+    """Get the host CPU name as detected by LLVM.
+
+    Returns
+    -------
+    cpu : str
+        The host CPU name, usable as -mcpu of an llvm target.
+    """
+    return _ffi_api.llvm_get_system_cpu()
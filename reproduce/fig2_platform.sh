@@ -1,25 +1,19 @@
 #!/bin/bash
 
-echo "autotuning in progress, this might take 1-2 days or longer"
+echo "autotuning in progress: 9 configurations x 20000 trials, this takes one to two days"
 echo "please dir platform/ for autotuning progress"
-echo "should contain 6 files with 20000 lines each file when done"
+echo "all configurations are tuned jointly into platform/tasks.json,"
+echo "rerunning this script resumes from it"
 echo ""
 echo "in progress..."
 
 bak_PYTHONPATH=$PYTHONPATH
 export PYTHONPATH=../ec
 
-for ecParity in 2 3 4
-do
-    for ecData in 8 9 10
-    do
-        echo -n "Autotune Parity=$ecParity Data=$ecData..."
-        python3 ../ec/benchmark.py \
-        -ecParity $ecParity -ecData $ecData -N 128000 \
-        --log_dir platform/ --result_file tmp.json --tune_num_trials_total 20000 >/dev/null 2>&1
-        echo "Done"
-    done
-done
+echo -n "Autotune Parity={2,3,4} Data={8,9,10}..."
+python3 ../ec/benchmark.py --config_file fig2_platform.json \
+--log_dir platform/ --result_file tmp.json >/dev/null 2>&1
+echo "Done"
 
 rm tmp.json
 